@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+"""Clean up many HTML files at once, using multiple processes.
+
+This does the same as running cleanup_msfp.py for each file, but is a lot faster
+for large sites: documents are distributed over a pool of worker processes, and
+each worker sets up BeautifulSoup and the cleanup configuration only once.
+Errors in single files (e.g. HTML that cannot be parsed) are reported, and do
+not stop the other files from being processed.
+
+With a cache directory, output is cached (see outputcache.py), so re-running a
+cleanup over a mostly unchanged site only cleans the changed documents.
+
+This so far needs BeautifulSoup v3, which is not available for Python 3.
+"""
+
+import os
+import sys
+from multiprocessing import Pool, cpu_count
+from optparse import OptionParser
+from cleanup_msfp import DocumentCleaner
+from outputcache import OutputCache
+from soupcleanup import SoupCleanupHelper
+
+# Extensions of files which are cleaned, if a directory is given as input.
+c_html_extensions = ['.htm', '.html']
+
+# Default maximum size of the output cache, in MB.
+c_cache_size = 1024
+
+# The DocumentCleaner, OutputCache (or None) and the cleaner's fingerprint used
+# by clean_file(), in a worker process.
+_cleaner = None
+_cache = None
+_fingerprint = None
+
+
+def get_file_pairs(input_paths, output_dir):
+    """Return (input file, output file) pairs for the given input paths.
+
+    input_paths can contain files and directories. Directories are searched
+    recursively for HTML files; the output files get the same relative path
+    inside output_dir as the input files have inside the input directory. Files
+    given directly are written into output_dir itself.
+
+    An exception is thrown if two different input files would be written to the
+    same output file, e.g. for a/index.htm and b/index.htm. (Otherwise one would
+    silently overwrite the other.) The same input file given twice is only
+    returned once.
+    """
+    candidates = []
+    for input_path in input_paths:
+        if os.path.isdir(input_path):
+            for dir_path, dir_names, file_names in os.walk(input_path):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    if (os.path.splitext(file_name)[1].lower() in
+                            c_html_extensions):
+                        path = os.path.join(dir_path, file_name)
+                        candidates.append((path, os.path.join(
+                            output_dir, os.path.relpath(path, input_path))))
+        else:
+            candidates.append((input_path, os.path.join(
+                output_dir, os.path.basename(input_path))))
+
+    file_pairs = []
+    # Input files by (normalized) output file.
+    inputs = {}
+    for input_path, output_path in candidates:
+        key = os.path.normcase(os.path.abspath(output_path))
+        if key in inputs:
+            if (os.path.realpath(inputs[key]) !=
+                    os.path.realpath(input_path)):
+                raise Exception('Input files ' + inputs[key] + ' and ' +
+                                input_path + ' would both be written to ' +
+                                output_path + '.')
+        else:
+            inputs[key] = input_path
+            file_pairs.append((input_path, output_path))
+    return file_pairs
+
+
+def get_input_size(file_pair):
+    """Return the size of the input file in a file pair; 0 if it's unknown."""
+    try:
+        return os.path.getsize(file_pair[0])
+    except OSError:
+        return 0
+
+
+def init_worker(config=None, cache_dir=None):
+    """Set up a (worker) process for cleaning files with clean_file()."""
+    global _cleaner, _cache, _fingerprint
+    _cleaner = DocumentCleaner(config)
+    if cache_dir:
+        _cache = OutputCache(cache_dir)
+        _fingerprint = _cleaner.get_fingerprint()
+    else:
+        _cache = None
+
+
+def clean_file(file_pair):
+    """Clean up one file; init_worker() must have been called first.
+
+    file_pair is an (input file, output file) tuple. The directory for the
+    output file is created if necessary. Returns an (input file, error, cached,
+    value_stats) tuple; error is None, or a description of the exception that
+    happened while reading, cleaning or writing. (Exceptions are not re-raised,
+    so that one bad file does not stop a batch.) cached is True if the output
+    came from the cache. value_stats is a (hits, misses) tuple for
+    SoupCleanupHelper.normalized_values while cleaning this file; every process
+    has its own, so the caller needs to add them up.
+    """
+    input_path, output_path = file_pair
+    values_cache = SoupCleanupHelper.normalized_values
+    hits = values_cache.hits
+    misses = values_cache.misses
+    output = None
+    error = None
+    cached = False
+    try:
+        html = open(input_path).read()
+        if _cache:
+            key = _cache.get_key(html, _fingerprint)
+            output = _cache.get(key)
+        cached = output is not None
+        if not cached:
+            output = _cleaner.clean(html)
+            if _cache:
+                _cache.set(key, output)
+        output_dir = os.path.dirname(output_path)
+        if output_dir and not os.path.isdir(output_dir):
+            try:
+                os.makedirs(output_dir)
+            except OSError:
+                # Another process may have created it just now.
+                if not os.path.isdir(output_dir):
+                    raise
+        # Write the output the same way cleanup_msfp.py prints it.
+        with open(output_path, 'w') as file_handle:
+            file_handle.write(output + '\n')
+    except Exception as e:
+        error = '%s: %s' % (e.__class__.__name__, e)
+    return (input_path, error, cached,
+            (values_cache.hits - hits, values_cache.misses - misses))
+
+
+def clean_files(file_pairs, processes=None, config=None, cache_dir=None):
+    """Clean up files, using a pool of processes.
+
+    file_pairs: a list of (input file, output file) tuples.
+    processes: the number of worker processes; default is the number of CPUs.
+      If 1, files are cleaned in the current process.
+    config: configuration for DocumentCleaner.
+    cache_dir: directory for an OutputCache, or None to not use a cache.
+      (Eviction of old items is up to the caller.)
+
+    This is a generator, which yields the tuple returned by clean_file() for
+    every file. If multiple processes are used, this is not
+    in the order of file_pairs, but in the order in which files are finished.
+    """
+    if not processes:
+        processes = cpu_count()
+    if processes == 1:
+        init_worker(config, cache_dir)
+        for file_pair in file_pairs:
+            yield clean_file(file_pair)
+        return
+
+    pool = Pool(processes, init_worker, (config, cache_dir))
+    try:
+        # Processing time mostly depends on file size, and a site usually has
+        # a few files that take longer than thousands of small ones together.
+        # So start with the largest files, and hand out files one at a time to
+        # whichever process is free; then all processes finish at about the
+        # same time, with small files. (Communicating per file costs little
+        # compared to cleaning it.)
+        for result in pool.imap_unordered(
+                clean_file, sorted(file_pairs, key=get_input_size,
+                                   reverse=True), 1):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def main():
+    """Clean up the files given on the command line."""
+    a = OptionParser(usage='usage: %prog [options] -o outputdir input...',
+                     description="Input arguments are 'non-clean' HTML files, "
+                     'and/or directories which are searched for HTML files. '
+                     'Cleaned-up versions are written into the output '
+                     'directory.')
+    a.add_option('-o', '--output-dir', help='directory to write files into')
+    a.add_option('-l', '--file-list', metavar='FILE',
+                 help='file containing input paths, one per line')
+    a.add_option('-j', '--jobs', type='int', default=0,
+                 help='number of worker processes (default: number of CPUs)')
+    a.add_option('-c', '--cache-dir',
+                 help='directory for caching output, to speed up re-runs')
+    a.add_option('--cache-size', type='int', default=c_cache_size,
+                 metavar='MB', help='maximum size of the cache (default: '
+                 '%default MB)')
+    (options, args) = a.parse_args()
+    if options.file_list:
+        args += [line.strip() for line in open(options.file_list)
+                 if line.strip()]
+    if not args or not options.output_dir:
+        print "Input arguments and an output directory are required!"
+        a.print_help()
+        exit()
+
+    try:
+        file_pairs = get_file_pairs(args, options.output_dir)
+    except Exception as e:
+        sys.stderr.write(str(e) + '\n')
+        exit(1)
+
+    errors = 0
+    cache = None
+    if options.cache_dir:
+        cache = OutputCache(options.cache_dir, options.cache_size * 1024 * 1024)
+    value_hits = value_misses = 0
+    for input_path, error, cached, value_stats in clean_files(
+            file_pairs, options.jobs, None, options.cache_dir):
+        value_hits += value_stats[0]
+        value_misses += value_stats[1]
+        if error:
+            errors += 1
+            sys.stderr.write(input_path + ': ' + error + '\n')
+        elif cache:
+            # Keep the statistics here; the workers have their own caches.
+            if cached:
+                cache.hits += 1
+            else:
+                cache.misses += 1
+    if cache:
+        removed = cache.evict()
+        sys.stderr.write('Cache: %(hits)d hits, %(misses)d misses.' %
+                         cache.get_stats())
+        if removed:
+            sys.stderr.write(' Removed %d old item(s).' % removed)
+        sys.stderr.write('\n')
+    # The cache of normalized attribute values is per process; report the
+    # totals, so its size can be checked. (Misses can be caused by a full cache
+    # or by values not seen before.)
+    max_size = SoupCleanupHelper.normalized_values.max_size
+    sys.stderr.write('Attribute value cache: %d hits, %d misses, max size %d '
+                     'per process.\n' % (value_hits, value_misses, max_size))
+    if errors:
+        sys.stderr.write('%d file(s) could not be cleaned.\n' % errors)
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
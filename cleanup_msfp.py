@@ -4,17 +4,26 @@
 This should be usable on other types of HTML too; try it. If it's not perfect:
 see if you can make changes. The code in this script is readable top-down and is
 commented well. (Most of the nitty gritty work is separated out into classes.)
+The cleanup itself is in DocumentCleaner.clean(); the script just calls that.
+
+This can also be imported, to clean many documents in one process:
+    from cleanup_msfp import clean_document
+    output = clean_document(html)
 
 This so far needs BeautifulSoup v3, which is not available for Python 3.
 """
 
+import hashlib
+import inspect
 import re
+import sys
 from optparse import OptionParser
 from BeautifulSoup import BeautifulSoup, Tag, Comment
 from htmlcleanup import HtmlCleanupHelper
 from soupcleanup import SoupCleanupHelper
 
-# Some constants used later:
+# Some constants used later: (These are the defaults for the configuration of
+# DocumentCleaner / clean_document(); see get_default_config().)
 # - Remove empty paragraphs after <ul>. (It _seems_ this is something you would
 #   always want to arrange in styling... but removing them may change vertical
 #   spacing / make things inconsistent, it if there are <ul>s with and without
@@ -29,274 +38,426 @@ c_img_bullet_re = r'(rom|exp)bul.?.?\.gif$'
 #   several families and one with only the first. To remove both, specify both.
 c_font_faces_to_remove = ['Book Antiqua, Times New Roman, Times',
                           'Book Antiqua']
-
-# We have no options yet, but optparse is a convenient way of printing usage,
-# if invoked with -h.
-a = OptionParser(usage='usage: %prog htmlfile',
-                 description="Input argument is a 'non-clean' HTML file; a "
-                 'cleaned-up version is printed to stdout.')
-(options, args) = a.parse_args()
-if len(args) != 1:
-    print "Number of command line arguments must be 1!"
-    a.print_help()
-    exit()
-
-html = open(args[0]).read()
-html = html.replace('\r\n', '\n')
-
-## Change the HTML before it gets parsed by BeautifulSoup.
-
-helper = HtmlCleanupHelper()
-
-# Clean up completely wrong HTML before parsing - #1:
-#
-# Strip superfluous font tag, because FrontPage does things like
-# <font> <center> </font> </center>, which makes HTMLTidy/BeautifulSoup
-# wronlgy 'correct' stuff that would be fine if those font tags weren't there.
-# Also, accommodate for recursive font tags... because _in between_ these
-# these idiotic tags there may be legit ones.
-#
-# This is a bit arbitrary because it only strips font tags with _only_ the
-# 'face' attribute. For better or worse, we so far are assuming that these are
-# the only "completely wrong" tags, and others can/will be handled by
-# BeautifulSoup (stripped/converted to spans if necessary) later.
-if c_font_faces_to_remove:
-    tag_contents = []
-    for font_family in c_font_faces_to_remove:
-        tag_contents.append('face="' + font_family + '"')
-    html = helper.remove_tags(html, 'font', tag_contents)
-
-# <o:p> tags are a mystery. So far, I've seen empty ones, ones with a small
-# amount of whitespace content, and single opening tags without a closing tag.
-html = helper.remove_tags(html, 'o:p')
-
-# Clean up completely wrong HTML before parsing - #2:
-#
-# Solve <b><p > .... </b> ... </p> by putting <b> inside <p>. (If we don't,
-# BeatifulSoup will put a </p> before the </b> which will mess up formatting.)
-#
-# We might abstract this into a CleanupHelper method if we want to do other
-# combinations of tags.
-rx1 = re.compile(r'\<b\>(\s*\<p.*?\>)(.*?)\<\/b>', re.S)
-for r in rx1.finditer(html):
-    if r.group(2).find('/p>') == -1:
-        html = html[:r.start()] + r.group(1) + '<b>' + html[r.start(2):]
-        # since html stays just as long, the finditer will be OK?
-
-## Now do tidying work using BeautifulSoup.
-
-soup = BeautifulSoup(html)
-helper = SoupCleanupHelper(soup)
-if c_font_faces_to_remove:
-    # Set 'face' attributes for removal, just in case there are <font> tags
-    # which have extra attributes in addition to 'face', because those would not
-    # have been matched / removed by HtmlCleanupHelper.remove_tags().
-    helper.remove_attributes['font'] = {}
-    helper.remove_attributes['font']['face'] = c_font_faces_to_remove
-
-## Soup part 1: remove some structural things, and unify for compliant HTML.
-
-# Delete all script tags.
-for tag in soup.findAll('script'):
-    tag.extract()
-
-# Delete comments; we assume we never want to keep MS Frontpage comments.
-for element in soup.findAll(text=lambda text: isinstance(text, Comment)):
-    element.extract()
-
-# Replace b->strong and i->em, for XHTML compliance, and so that we're sure we
-# are not skipping tags in the code below.
-for tag in soup.findAll('b'):
-    e = Tag(soup, 'strong')
-    tag.parent.insert(helper.get_index_in_parent(tag), e)
-    helper.move_contents_inside(tag, e)
-    tag.extract()
-for tag in soup.findAll('i'):
-    e = Tag(soup, 'em')
-    tag.parent.insert(helper.get_index_in_parent(tag), e)
-    helper.move_contents_inside(tag, e)
-    tag.extract()
-
-
-## Soup part 2: work on large block elements in document structure.
-
-# Delete tables with one TR having one TD; these are useless.
-#
-# (Take their contents out of the tables.)
-for table in soup.findAll('table'):
-    helper.remove_single_cell_table(table)
-
-# Our HTML uses tables as a way to make bullet points:
-# one table with each row having 2 fields, the first of which only
-# contains a 'bullet point image'.
-# Replace those tables by <ul><li> structures.
-regex = re.compile(c_img_bullet_re)
-for table in soup.findAll('table'):
-    helper.check_convert_table_to_list(table, regex)
-
-# Delete/change superfluous alignment attributes (and <center> tags sometimes).
-helper.check_alignment(soup.body, 'left')
-
-
-## Soup part 3: change/remove/unify contents of other tags.
-#
-# Generally try to unify stuff before removing/changing stuff.
-
-# Some 'a' tags have 'strong' tags surrounding them, and some have 'strong' tags
-# inside them. Normalize this so that 'a' is always inside.
-for tag in soup.findAll('a'):
-    r1 = tag.findAll('strong', recursive=False)
-    if r1:
-        r2 = tag.findAll(recursive=False)
-        if (len(r1) == len(r2) and
-                not helper.get_contents(tag, 'nonwhitespace_string')):
-            # All tags are 'strong' and all navigablestrings are whitespace.
-            # Delete the 'strong'. (Can be a chain of multiple, in extreme weird
-            # cases).
-            for element in r1:
-                helper.move_contents_before(element, element)
-                element.extract()
-            # Make 'strong' tag and move element inside it
-            element = Tag(soup, 'strong')
-            tag.parent.insert(helper.get_index_in_parent(tag), element)
-            element.insert(0, tag)
-# Maybe TODO: have a class for 'strong' links? That would remove the need for:
-# Links are rendered in bold, by default.
-# Some links have a 'b' around it, which makes no visual difference but
-# is an inconsistency in the document structure. Remove it.
-#r = soup.findAll('a')
-#for e in r:
-#  s = e.parent.__repr__()
-#  if s[0:3] == '<b>' and s[-4:] == '</b>':
-    # the 'b' may have more content than just the link. As long as that's all
-    # whitespace, there is still no difference in taking it away.
-#    ok = 1
-#    for ee in e.parent.contents:
-#      if ee != e and not(helper.regex_search(ee, rx_spacehtml_only)):
-#        ok = 0
-#        break
-#    if ok:
-#      ee = e.parent
-#      helper.move_contents_before(ee, ee)
-#      ee.extract()
-
-# Move leading/trailing whitespace out of inline tags into parents; remove empty
-# tags.
-#
-# This could be useful to do before mangle_tag() stuff, because then we don't
-# have to deal with attributes inside these empty tags; they will just be
-# removed. We assume these inline tags don't contain attributes like 'id' which
-# must be preserved. (This is why we won't do 'div' and 'a' here. These could be
-# processed despite not being pure-inline tags, but only if they don't have an
-# 'id', and preferrably after mangle_tag(). But right now we won't; it seems too
-# much trouble for little/no gain.)
-for tag_name in helper.inline_tag_names:
-    for tag in soup.findAll(tag_name):
-        helper.move_whitespace_to_parent(tag, tag_name != 'a')
-
-# Check if we can get rid of some inline tags if we move their attributes to a
-# child/parent; also normalize their attributes.
-#
-# <font> must come first; it has special handling so it's always removed (and
-# replaced by <span> if necessary). We're not sure of what definition we adhere
-# to yet:
-# - <div> is not an inline element but we assume we can remove it for MS
-#   Frontpage pages without trouble. (If this turns out not to be the case, we
-#   might need to change check_alignment() because that may leave empty <div>s
-#   around which are in fact unnecessary.)
-# - <p> is also not an inline element, but we assume we can remove it if it is
-#   the single tag wrapped in another element (like e.g. blockquote, li). (Or
-#   wrapping a single other element, but that probably won't happen.) We must
-#   leave it at the end though, because we want other tags to be removed in
-#   favor of <p>.
-for tag_name in ['font', 'div', 'span', 'a', 'p']:
-    for tag in soup.findAll(tag_name):
-        helper.mangle_tag(tag)
-
-# Normalize other tags' attributes if necessary.
-#
-# (h2 / h4 tags with cleanable attributes found in one website. Adding h3.)
-for tag_name in ['p', 'h2', 'h3', 'h4']:
-    for t in soup.findAll(tag_name):
-        helper.mangle_attributes(t)
-
-# Now that spacing is moved to where it should be and unnecessary tags are gone:
-
-# Remove duplicate spacing and unnecessary newlines.
-#
-# This implies first concatenating any adjacent NavigableStrings (which can
-# occur where we've extract()ed tags).
-#
-# Remove newlines except if the string is at the start of a rendered line. (This
-# includes newlines inside <p>s; see newline policy. Also we've seen e.g. h2
-# tags with two newlines in the middle of the title so we explicitly want to do
-# those.) We won't recurse into child tags; we don't dare to assume that no tags
-# will have problems with whitespace removal - e.g. <pre>.)
-for tag_name in helper.inline_tag_names + \
-    ['p', 'h2', 'h3', 'h4', 'li', 'blockquote']:
-    for tag in soup.findAll(tag_name):
-        r = tag.contents
-        i = 0
-        while i < len(r):
-            # Skip to next string.
-            if r[i].__class__.__name__ == 'NavigableString':
-                # This may shorten r, but does not extract r[i].
-                helper.dedupe_whitespace(r[i])
-            i += 1
-
-# Remove unnecessary whitespace at start/end of non-inline tags.
-#
-# This does not make a difference for rendering; it just makes for neater HTML.
-# (We've often seen useless &nbsp;s at the end of lines (li/p) which are just
-# ugly. We just do the rest too because why not.)
-for tag_name in ['p', 'h2', 'h3', 'h4', 'li', 'blockquote', 'div']:
-    for tag in soup.findAll(tag_name):
-        helper.strip_non_inline_whitespace(tag,
-                                           True if tag_name == 'li' else None)
-helper.strip_non_inline_whitespace(soup.body)
-
-# In the same vein, remove unnecessary whitespace just before and after <br>s.
-#
-# This is partly duplicate because most NavigableStrings around <br> have
-# been processed by the previous code block. This also does <br>s that are
-# not inside (the first level of) the tags specified just above.
-for tag in soup.findAll('br'):
-    element = tag.previousSibling
-    if element != None and element.__class__.__name__ == 'NavigableString':
-        helper.strip_trailing_whitespace(element)
-    element = tag.nextSibling
-    if element != None and element.__class__.__name__ == 'NavigableString':
-        helper.strip_leading_whitespace(element)
-
-# If there's one empty paragraph after 'block elements', remove it.
-# (We assume that such whitespacea should be implemented in a unified way using
-# CSS in the target, not using HTML.)
-if c_remove_empty_paragraphs_under_blocks:
-    for tag_name in ['table', 'ul']:
-        for tag in soup.findAll(tag_name):
+# - Inline tags which are opened just before a block-level tag but closed inside
+#   it, like <b><p> ... </b> ... </p>. The inline start tag will be moved inside
+#   the block-level tag. Format: list of (inline tag, block-level tag) tuples;
+#   e.g. ('i', 'p') or ('font', 'center') could be added if necessary.
+c_misnested_tags = [('b', 'p')]
+# - Remove scripts, comments and MS Office specific markup from the HTML before
+#   it gets parsed, rather than removing them from the parsed document later.
+#   (This is faster, and the document we work on gets smaller.) The list
+#   contains names of tags which are removed including their contents; e.g.
+#   'style' could be added.
+c_prune_before_parsing = True
+c_prune_tags = ['script']
+# - Tags whose attributes are normalized before the HTML gets parsed. This is
+#   done again after parsing, but is faster before. (These are the tags whose
+#   attributes always get normalized below. Other tags can be added, but keep in
+#   mind that this will make their attributes get normalized too.)
+c_normalize_attributes_before_parsing = ['p', 'h2', 'h3', 'h4', 'div', 'span']
+
+
+
+def get_default_config():
+    """Return the default configuration for DocumentCleaner, as a dict.
+
+    The keys are the names of the constants above, without 'c_'. The dict can
+    be changed (or a dict with only some of the keys can be made) and passed
+    to DocumentCleaner() or clean_document().
+    """
+    return {
+        'remove_empty_paragraphs_under_blocks':
+            c_remove_empty_paragraphs_under_blocks,
+        'img_bullet_re': c_img_bullet_re,
+        'font_faces_to_remove': list(c_font_faces_to_remove),
+        'misnested_tags': list(c_misnested_tags),
+        'prune_before_parsing': c_prune_before_parsing,
+        'prune_tags': list(c_prune_tags),
+        'normalize_attributes_before_parsing':
+            list(c_normalize_attributes_before_parsing),
+    }
+
+
+class DocumentCleaner(object):
+    """Cleans up HTML documents, according to a configuration.
+
+    Everything that does not depend on the document (the helper classes and
+    their rules, compiled regular expressions) is set up once, when the
+    object is created; so use the same object for cleaning many documents.
+    """
+
+    def __init__(self, config=None):
+        """Set up for cleaning documents.
+
+        config is a dict with (some of) the keys returned by
+        get_default_config(); missing keys get the default value.
+        """
+        self.config = get_default_config()
+        if config:
+            for key in config:
+                if key not in self.config:
+                    raise Exception('Unknown configuration key: ' + key)
+            self.config.update(config)
+        config = self.config
+
+        self.html_helper = HtmlCleanupHelper()
+
+        # Strip superfluous font tags before parsing; see clean(). This is a
+        # bit arbitrary because it only strips font tags with _only_ the
+        # 'face' attribute. For better or worse, we so far are assuming that
+        # these are the only "completely wrong" tags, and others can/will be
+        # handled by BeautifulSoup (stripped/converted to spans if necessary)
+        # later.
+        #
+        # (We collect all tags to strip first, and then strip them in one go;
+        # that only needs one pass over the document regardless of how many
+        # tags are stripped.)
+        self.tags_to_remove = []
+        if config['font_faces_to_remove']:
+            tag_contents = []
+            for font_family in config['font_faces_to_remove']:
+                tag_contents.append('face="' + font_family + '"')
+            self.tags_to_remove.append(('font', tag_contents))
+
+        # <o:p> tags are a mystery. So far, I've seen empty ones, ones with a
+        # small amount of whitespace content, and single opening tags without a
+        # closing tag.
+        self.tags_to_remove.append(('o:p', None))
+
+        # The rules for removing attributes are used both before and after
+        # parsing; set up the BeautifulSoup helper now.
+        self.soup_helper = SoupCleanupHelper()
+        if config['font_faces_to_remove']:
+            # Set 'face' attributes for removal, just in case there are <font>
+            # tags which have extra attributes in addition to 'face', because
+            # those would not have been matched / removed by
+            # HtmlCleanupHelper.remove_tags().
+            self.soup_helper.remove_attributes['font'] = {}
+            self.soup_helper.remove_attributes['font']['face'] = \
+                config['font_faces_to_remove']
+        self.soup_helper.update_removal_rules()
+
+        self.img_bullet_regex = re.compile(config['img_bullet_re'])
+
+    def clean(self, html):
+        """Clean up a HTML document; return the cleaned-up HTML."""
+        config = self.config
+        html = html.replace('\r\n', '\n')
+
+        ## Change the HTML before it gets parsed by BeautifulSoup.
+
+        helper = self.html_helper
+
+        # Remove scripts, comments, and Office markup that doesn't mean
+        # anything for HTML. (Do this first so that e.g. tags inside comments
+        # or scripts can't confuse the code below.)
+        if config['prune_before_parsing']:
+            html = helper.prune_html(html, config['prune_tags'])
+
+        # Clean up completely wrong HTML before parsing - #1:
+        #
+        # Strip superfluous font tag, because FrontPage does things like
+        # <font> <center> </font> </center>, which makes HTMLTidy/BeautifulSoup
+        # wronlgy 'correct' stuff that would be fine if those font tags weren't
+        # there. Also, accommodate for recursive font tags... because _in
+        # between_ these these idiotic tags there may be legit ones. Also strip
+        # <o:p> tags. (See __init__().)
+        html = helper.remove_multiple_tags(html, self.tags_to_remove)
+
+        # Clean up completely wrong HTML before parsing - #2:
+        #
+        # Solve <b><p > .... </b> ... </p> by putting <b> inside <p>. (If we
+        # don't, BeatifulSoup will put a </p> before the </b> which will mess
+        # up formatting.) Other combinations of tags can be added to the
+        # configuration.
+        if config['misnested_tags']:
+            html = helper.fix_misnested_tags(html, config['misnested_tags'])
+
+        # Remove/change attributes (like 'lang', MS Office specific styles)
+        # from tags which will get their attributes normalized after parsing
+        # anyway. Doing most of this work before parsing means the soup is
+        # smaller and less tags need to be merged later. The rules are the ones
+        # which the BeautifulSoup helper uses.
+        if config['normalize_attributes_before_parsing']:
+            html = helper.normalize_attributes(
+                html, config['normalize_attributes_before_parsing'],
+                self.soup_helper.get_normalized_attribute)
+
+        ## Now do tidying work using BeautifulSoup.
+
+        soup = BeautifulSoup(html)
+        helper = self.soup_helper
+        helper.soup = soup
+
+        ## Soup part 1: remove some structural things, and unify for compliant
+        ## HTML.
+
+        # Do a number of things that can be done for each tag separately, in
+        # one pass through the document:
+        # - Delete all script tags and comments; we assume we never want to
+        #   keep MS Frontpage comments. (Most of them are usually removed
+        #   before parsing already, but not e.g. unclosed <script> tags, which
+        #   the parser makes swallow the rest of the document. Checking for
+        #   them costs next to nothing in this pass.)
+        # - Replace b->strong and i->em, for XHTML compliance, and so that
+        #   we're sure we are not skipping tags in the code below.
+        # (Normalizing attributes cannot be done in this pass; it would change
+        # the 'align' attributes which check_alignment() looks at.)
+        handlers = {
+            'b': [lambda tag: helper.replace_tag(tag, 'strong')],
+            'i': [lambda tag: helper.replace_tag(tag, 'em')],
+            'script': [helper.extract],
+            Comment: [helper.extract],
+        }
+        helper.visit(handlers)
+
+        ## Soup part 2: work on large block elements in document structure.
+
+        # Delete tables with one TR having one TD; these are useless.
+        #
+        # (Take their contents out of the tables.)
+        #
+        # Our HTML uses tables as a way to make bullet points:
+        # one table with each row having 2 fields, the first of which only
+        # contains a 'bullet point image'.
+        # Replace those tables by <ul><li> structures.
+        helper.check_tables(self.img_bullet_regex)
+
+        # Delete/change superfluous alignment attributes (and <center> tags
+        # sometimes).
+        helper.check_alignment(soup.body, 'left')
+
+        ## Soup part 3: change/remove/unify contents of other tags.
+        #
+        # Generally try to unify stuff before removing/changing stuff.
+
+        # Some 'a' tags have 'strong' tags surrounding them, and some have
+        # 'strong' tags inside them. Normalize this so that 'a' is always
+        # inside.
+        for tag in helper.find_tags('a'):
+            summary = helper.get_child_summary(tag)
+            r1 = summary['tags_by_name'].get('strong')
+            if r1:
+                if (len(r1) == len(summary['tags']) and
+                        not summary['strings']):
+                    # All tags are 'strong' and all navigablestrings are
+                    # whitespace. Delete the 'strong'. (Can be a chain of
+                    # multiple, in extreme weird cases).
+                    for element in r1:
+                        helper.move_contents_before(element, element)
+                        helper.extract(element)
+                    # Make 'strong' tag and move element inside it
+                    element = Tag(soup, 'strong')
+                    helper.insert_before(tag, element)
+                    helper.insert(element, 0, tag)
+        # Maybe TODO: have a class for 'strong' links? That would remove the
+        # need for:
+        # Links are rendered in bold, by default.
+        # Some links have a 'b' around it, which makes no visual difference but
+        # is an inconsistency in the document structure. Remove it.
+        #r = helper.find_tags('a')
+        #for e in r:
+        #  s = e.parent.__repr__()
+        #  if s[0:3] == '<b>' and s[-4:] == '</b>':
+            # the 'b' may have more content than just the link. As long as
+            # that's all whitespace, there is still no difference in taking it
+            # away.
+        #    ok = 1
+        #    for ee in e.parent.contents:
+        #      if ee != e and not(helper.regex_search(ee, rx_spacehtml_only)):
+        #        ok = 0
+        #        break
+        #    if ok:
+        #      ee = e.parent
+        #      helper.move_contents_before(ee, ee)
+        #      ee.extract()
+
+        # Move leading/trailing whitespace out of inline tags into parents;
+        # remove empty tags.
+        #
+        # This could be useful to do before mangle_tag() stuff, because then we
+        # don't have to deal with attributes inside these empty tags; they will
+        # just be removed. We assume these inline tags don't contain attributes
+        # like 'id' which must be preserved. (This is why we won't do 'div' and
+        # 'a' here. These could be processed despite not being pure-inline
+        # tags, but only if they don't have an 'id', and preferrably after
+        # mangle_tag(). But right now we won't; it seems too much trouble for
+        # little/no gain.)
+        for tag_name in helper.inline_tag_names:
+            for tag in helper.find_tags(tag_name):
+                helper.move_whitespace_to_parent(tag, tag_name != 'a')
+
+        # Check if we can get rid of some inline tags if we move their
+        # attributes to a child/parent; also normalize their attributes.
+        #
+        # <font> must come first; it has special handling so it's always
+        # removed (and replaced by <span> if necessary). We're not sure of what
+        # definition we adhere to yet:
+        # - <div> is not an inline element but we assume we can remove it for
+        #   MS Frontpage pages without trouble. (If this turns out not to be the
+        #   case, we might need to change check_alignment() because that may
+        #   leave empty <div>s around which are in fact unnecessary.)
+        # - <p> is also not an inline element, but we assume we can remove it
+        #   if it is the single tag wrapped in another element (like e.g.
+        #   blockquote, li). (Or wrapping a single other element, but that
+        #   probably won't happen.) We must leave it at the end though, because
+        #   we want other tags to be removed in favor of <p>.
+        for tag_name in ['font', 'div', 'span', 'a', 'p']:
+            for tag in helper.find_tags(tag_name):
+                helper.mangle_tag(tag)
+
+        # Normalize other tags' attributes if necessary.
+        #
+        # (h2 / h4 tags with cleanable attributes found in one website. Adding
+        # h3.)
+        for tag_name in ['p', 'h2', 'h3', 'h4']:
+            for t in helper.find_tags(tag_name):
+                helper.mangle_attributes(t)
+
+        # Now that spacing is moved to where it should be and unnecessary tags
+        # are gone:
+
+        # Remove duplicate spacing and unnecessary newlines.
+        #
+        # This implies first concatenating any adjacent NavigableStrings (which
+        # can occur where we've extract()ed tags).
+        #
+        # Remove newlines except if the string is at the start of a rendered
+        # line. (This includes newlines inside <p>s; see newline policy. Also
+        # we've seen e.g. h2 tags with two newlines in the middle of the title
+        # so we explicitly want to do those.) We only do strings directly
+        # inside these tags, not inside any other child tags; we don't dare to
+        # assume that no tags will have problems with whitespace removal - e.g.
+        # <pre>.) This is done in one pass over the document.
+        helper.dedupe_all_whitespace(helper.inline_tag_names +
+                                     ['p', 'h2', 'h3', 'h4', 'li',
+                                      'blockquote'])
+
+        # Remove unnecessary whitespace at start/end of non-inline tags.
+        #
+        # This does not make a difference for rendering; it just makes for
+        # neater HTML. (We've often seen useless &nbsp;s at the end of lines
+        # (li/p) which are just ugly. We just do the rest too because why not.)
+        for tag_name in ['p', 'h2', 'h3', 'h4', 'li', 'blockquote', 'div']:
+            for tag in helper.find_tags(tag_name):
+                helper.strip_non_inline_whitespace(
+                    tag, True if tag_name == 'li' else None)
+        helper.strip_non_inline_whitespace(soup.body)
+
+        # In the same vein, remove unnecessary whitespace just before and after
+        # <br>s.
+        #
+        # This is partly duplicate because most NavigableStrings around <br>
+        # have been processed by the previous code block. This also does <br>s
+        # that are not inside (the first level of) the tags specified just
+        # above.
+        for tag in helper.find_tags('br'):
+            element = tag.previousSibling
+            if element != None and helper.is_string(element):
+                helper.strip_trailing_whitespace(element)
             element = tag.nextSibling
-            while helper.regex_search(element, helper.rx_nbspace_only):
-                element = element.nextSibling
-            if helper.get_tag_name(element) == 'p' and not element.contents:
-                element.extract()
-
-# Remove empty paragraphs at the end of the document. (Same reason.)
-#
-# Because of earlier calls, paragraphs have no whitespace inside them anymore if
-# they are empty, and whitespace after the last paragraphs can only be single
-# newlines.
-last_tag = soup.body.contents[-1]
-if last_tag.__class__.__name__ == 'NavigableString' and str(last_tag) == '\n':
-    last_tag = last_tag.previousSibling
-while helper.get_tag_name(last_tag) == 'div':
-    last_tag = last_tag.contents[-1]
-    if last_tag.__class__.__name__ == 'NavigableString' and str(last_tag) == '\n':
-        last_tag = last_tag.previousSibling
-while helper.get_tag_name(last_tag) == 'p' and not last_tag.contents:
-    tag = last_tag.previousSibling
-    last_tag.extract()
-    last_tag = tag
-
-# BeautifulSoup (at least 3.x tested so far) outputs <br />, which is kind-of
-# illegal and certainly unnecessary as HTML.
-print str(soup).replace('<br />', '<br>')
+            if element != None and helper.is_string(element):
+                helper.strip_leading_whitespace(element)
+
+        # If there's one empty paragraph after 'block elements', remove it.
+        # (We assume that such whitespacea should be implemented in a unified
+        # way using CSS in the target, not using HTML.)
+        if config['remove_empty_paragraphs_under_blocks']:
+            for tag_name in ['table', 'ul']:
+                for tag in helper.find_tags(tag_name):
+                    element = tag.nextSibling
+                    while helper.is_whitespace(element):
+                        element = element.nextSibling
+                    if (helper.get_tag_name(element) == 'p' and
+                            not element.contents):
+                        helper.extract(element)
+
+        # Remove empty paragraphs at the end of the document. (Same reason.)
+        #
+        # Because of earlier calls, paragraphs have no whitespace inside them
+        # anymore if they are empty, and whitespace after the last paragraphs
+        # can only be single newlines.
+        last_tag = soup.body.contents[-1]
+        if helper.is_string(last_tag) and str(last_tag) == '\n':
+            last_tag = last_tag.previousSibling
+        while helper.get_tag_name(last_tag) == 'div':
+            last_tag = last_tag.contents[-1]
+            if helper.is_string(last_tag) and str(last_tag) == '\n':
+                last_tag = last_tag.previousSibling
+        while helper.get_tag_name(last_tag) == 'p' and not last_tag.contents:
+            tag = last_tag.previousSibling
+            helper.extract(last_tag)
+            last_tag = tag
+
+        # BeautifulSoup (at least 3.x tested so far) outputs <br />, which is
+        # kind-of illegal and certainly unnecessary as HTML.
+        return str(soup).replace('<br />', '<br>')
+
+    def get_fingerprint(self):
+        """Return a string which identifies the cleanup this object does.
+
+        Cleaners with equal fingerprints give the same output for the same
+        document: the fingerprint is a hash of the configuration, the settings
+        of the helpers (which can be changed after creating this object) and
+        the code version. This is meant for caching output.
+        """
+        key = (get_code_version(), sorted(self.config.items()),
+               self.soup_helper.get_settings_key())
+        return hashlib.sha1(repr(key)).hexdigest()
+
+
+# Hash of the source code; see get_code_version().
+_code_version = None
+
+
+def get_code_version():
+    """Return a string which identifies the version of the cleanup code.
+
+    This is a hash of the source code of this script and the helper classes,
+    and the BeautifulSoup version; it changes with any change to the code.
+    """
+    global _code_version
+    if _code_version is None:
+        sha = hashlib.sha1(sys.modules[BeautifulSoup.__module__].__version__)
+        for cls in (DocumentCleaner, HtmlCleanupHelper, SoupCleanupHelper):
+            sha.update(inspect.getsource(sys.modules[cls.__module__]))
+        _code_version = sha.hexdigest()
+    return _code_version
+
+
+# DocumentCleaner objects used by clean_document(), by configuration.
+_cleaners = {}
+
+
+def clean_document(html, config=None):
+    """Clean up a HTML document; return the cleaned-up HTML.
+
+    config: see DocumentCleaner. The DocumentCleaner for a configuration is
+    kept, so calling this for many documents only sets up cleaning once.
+    """
+    key = repr(sorted((config or {}).items()))
+    cleaner = _cleaners.get(key)
+    if cleaner is None:
+        cleaner = DocumentCleaner(config)
+        _cleaners[key] = cleaner
+    return cleaner.clean(html)
+
+
+def main():
+    """Clean up the HTML file given on the command line; print the result."""
+    # We have no options yet, but optparse is a convenient way of printing
+    # usage, if invoked with -h.
+    a = OptionParser(usage='usage: %prog htmlfile',
+                     description="Input argument is a 'non-clean' HTML file; a "
+                     'cleaned-up version is printed to stdout.')
+    (options, args) = a.parse_args()
+    if len(args) != 1:
+        print "Number of command line arguments must be 1!"
+        a.print_help()
+        exit()
+
+    print clean_document(open(args[0]).read())
+
+
+if __name__ == '__main__':
+    main()
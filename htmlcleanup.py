@@ -12,9 +12,82 @@ Some methods throw exceptions for un-parseable HTML; they are not documented
 properly yet.
 """
 
+import re
+
+
 class HtmlCleanupHelper(object):
     """Utility methods for HTML Cleanup."""
 
+    # Regular expressions for attributes inside a start tag. One attribute is:
+    # whitespace; name; (optional) '=' with surrounding whitespace; value.
+    rx_attribute = re.compile(
+        r'(\s+)([^\s"\'=/>]+)(?:(\s*=\s*)("[^"]*"|\'[^\']*\'|[^\s"\'>]+))?')
+    # The source for a sequence of attributes, for use inside other regexes.
+    rx_attributes_src = \
+        r'(?:\s+[^\s"\'=/>]+(?:\s*=\s*(?:"[^"]*"|\'[^\']*\'|[^\s"\'>]+))?)*'
+
+    @staticmethod
+    def prune_html(html, tag_names=None, comments=True, office_markup=True):
+        """Remove content that we never want to keep, before parsing the HTML.
+
+        Removing things like scripts and comments from the HTML string is
+        cheaper than having BeautifulSoup parse them into the document and then
+        walking the document to find and remove them. This is done in one pass
+        over the document.
+
+        tag_names: list of names of tags which are removed including their
+        contents, e.g. ['script', 'style']. Tags are matched case insensitively.
+        comments: if True, remove HTML comments. This includes MS Office
+        'downlevel-hidden' conditional comments like <!--[if gte mso 9]> ...
+        <![endif]-->.
+        office_markup: if True, remove MS Office specific markup which has no
+        meaning for HTML:
+        - 'downlevel-revealed' conditional comment markers, like
+          <![if !supportEmptyParas]> and <![endif]>; their contents are kept.
+          (BeautifulSoup strips these markers itself, too.)
+        - XML namespace declarations: xmlns:o="..." attributes in start tags,
+          and <?xml:namespace ... > processing instructions.
+
+        returns: changed html.
+        """
+        patterns = []
+        if tag_names:
+            # (?P=...) makes sure that the end tag matches the start tag.
+            patterns.append(
+                '<(?P<tag>' + '|'.join([re.escape(name) for name in tag_names])
+                + r')(?=[\s/>])[^>]*>.*?</(?P=tag)\s*>')
+        if comments:
+            patterns.append('<!--.*?-->')
+        if office_markup:
+            patterns.append(r'<!\[(?:if\s[^\]]*|endif)\]>')
+            patterns.append(r'<\?xml:namespace\s[^>]*>')
+            # Start tags containing namespace declarations. (These are only
+            # matched if we understand the attributes, in the same way as
+            # normalize_attributes(); tags we don't understand are left alone.)
+            patterns.append(
+                r'<[a-z][^\s/>]*(?=[^<>]*\sxmlns:)(?P<ns_attributes>'
+                + HtmlCleanupHelper.rx_attributes_src + r')\s*/?>')
+        if not patterns:
+            return html
+
+        # Since this is one regex, matches can never overlap, and e.g. a comment
+        # inside a script is removed together with the script.
+        rx_prune = re.compile('|'.join(patterns), re.S | re.I)
+        spans = []
+        for match in rx_prune.finditer(html):
+            if match.groupdict().get('ns_attributes') is None:
+                spans.append((match.start(), match.end(), ''))
+            else:
+                # Only remove the namespace declarations from the start tag.
+                attributes = []
+                for attr in HtmlCleanupHelper.rx_attribute.finditer(
+                        match.group('ns_attributes')):
+                    if not attr.group(2).lower().startswith('xmlns:'):
+                        attributes.append(attr.group())
+                spans.append((match.start('ns_attributes'),
+                              match.end('ns_attributes'), ''.join(attributes)))
+        return HtmlCleanupHelper._replace_spans(html, spans)
+
     @staticmethod
     def remove_tags(html, tag_name, tag_contents=None):
         """Remove tags from a HTML document. (Don't remove their contents.)
@@ -37,111 +110,331 @@ class HtmlCleanupHelper(object):
 
         returns: changed html.
         """
-        # Set up some values for easier searching, with duplicate-ish values.
-        # At least  one of search_simple_tag and search_tag_with_attribute will
-        # be true.
-        end_tag = '</' +tag_name + '>'
-        end_tag_len = len(end_tag)
-        simple_start_tag = '<' + tag_name + '>'
-        compound_start_tag_start = '<' + tag_name + ' '
-        search_compound_tag = False
-        start_tags_to_strip = []
-        if tag_contents:
-            search_simple_tag = False
-            for inside in tag_contents:
-                if inside:
-                    search_compound_tag = True
-                    start_tags_to_strip.append(compound_start_tag_start + inside
-                                               + '>')
-                else:
-                    search_simple_tag = True
-                    start_tags_to_strip.append(simple_start_tag)
-        else:
-            # Match simple tag, and any compound tag.
-            search_simple_tag = True
-            search_compound_tag = True
-            start_tags_to_strip.append(simple_start_tag)
-            start_tags_to_strip.append(compound_start_tag_start)
-
-        next_process_pos = 0
-        found = []
-        while True:
-            # Find an end tag, then find/store all start tags leading up to it
-            # and match the last stored start tag with the end tag. This should
-            # accommodate for recursive tags.
-            end_pos = html.find(end_tag, next_process_pos)
-            start_pos = -2
-            while start_pos != -1 and start_pos < end_pos:
-                if start_pos != -2:
-                    found.append(start_pos)
-                    next_process_pos = start_pos + 1
-                if search_simple_tag:
-                    start_pos = html.find(simple_start_tag, next_process_pos)
-                if search_compound_tag:
-                    p = html.find(compound_start_tag_start, next_process_pos)
-                    if not search_simple_tag or (p != -1 and p < start_pos):
-                        start_pos = p
-            if end_pos == -1:
-                # No more tag pairs / end tags left.
-                break
-            if not found:
+        return HtmlCleanupHelper.remove_multiple_tags(
+            html, [(tag_name, tag_contents)])
+
+    @staticmethod
+    def remove_multiple_tags(html, tag_specs):
+        """Remove several kinds of tags from a HTML document, in one pass.
+
+        This does the same as calling remove_tags() for each tag, but it only
+        scans (and copies) the document once, however many tags are specified.
+
+        tag_specs: a list of (tag_name, tag_contents) tuples. See remove_tags()
+        for the meaning of tag_contents; it can be None. A tag name can be
+        specified more than once; tags matching any of its specs are removed.
+
+        returns: changed html.
+        """
+        # Merge specs for the same tag name. An empty tag_contents means all
+        # tags of this name, which includes those matching any other spec.
+        merged_specs = {}
+        for (tag_name, tag_contents) in tag_specs:
+            if tag_name not in merged_specs:
+                merged_specs[tag_name] = tag_contents
+            elif merged_specs[tag_name] and tag_contents:
+                merged_specs[tag_name] = (list(merged_specs[tag_name]) +
+                                          list(tag_contents))
+            else:
+                merged_specs[tag_name] = None
+
+        # Set up some values for easier searching, per tag name. Every tag name
+        # gets its own stack of found start tags, because e.g. a </font> must
+        # only ever be matched with a <font>.
+        tags = {}
+        for (tag_name, tag_contents) in merged_specs.items():
+            simple_start_tag = '<' + tag_name + '>'
+            compound_start_tag_start = '<' + tag_name + ' '
+            start_tags_to_strip = []
+            if tag_contents:
+                for inside in tag_contents:
+                    if inside:
+                        start_tags_to_strip.append(compound_start_tag_start
+                                                   + inside + '>')
+                    else:
+                        start_tags_to_strip.append(simple_start_tag)
+            else:
+                # Match simple tag, and any compound tag.
+                start_tags_to_strip.append(simple_start_tag)
+                start_tags_to_strip.append(compound_start_tag_start)
+            tags[tag_name] = {
+                'contents': tag_contents,
+                'simple_start_tag': simple_start_tag,
+                'compound_start_tag_start': compound_start_tag_start,
+                'start_tags_to_strip': start_tags_to_strip,
+                'found': [],
+            }
+        if not tags:
+            return html
+
+        # Find all start/end tags in one pass over the document. We don't
+        # change the html while doing this; we only record the (start, end)
+        # positions of the strings to remove, and construct the new html at
+        # the very end. This keeps the whole thing linear in the size of the
+        # document, regardless of how many tags we remove.
+        #
+        # We always need to find all start tags (also the ones we won't strip)
+        # in order to match them up with the right end tags. Group 1 is the
+        # tag name for end tags; group 2 for start tags.
+        names = '|'.join([re.escape(tag_name) for tag_name in tags])
+        rx_tags = re.compile('</(' + names + ')>|<(' + names + ')[ >]')
+
+        remove_spans = []
+        for match in rx_tags.finditer(html):
+            if match.group(2):
+                # Store start tags; each end tag is matched with the last
+                # stored start tag. This should accommodate for recursive
+                # tags.
+                tags[match.group(2)]['found'].append(match.start())
+                continue
+            tag_name = match.group(1)
+            tag = tags[tag_name]
+            end_pos = match.start()
+            if not tag['found']:
                 # Unpaired end tag(s) left. We can't trust that we matched up
-                # the right start/end pairs, with the above algorithm. (The
-                # position we print is probably wrong because we may have
-                # removed tags already; fix that?)
+                # the right start/end pairs, with the above algorithm.
                 raise Exception(tag_name + \
                                 ' end tag without start tag found at pos ~' +
                                 str(end_pos))
-            next_process_pos = end_pos + 1
 
             # Get last non-processed start tag; check if we want to remove it.
             # If not, skip this start/end pair and continue to the next pair.
-            start_pos = found.pop()
-            for start_tag in start_tags_to_strip:
-                if html[start_pos : start_pos + len(start_tag)] == start_tag:
-                    # Delete corresponding start/end tags from the html.
-                    html = html[:start_pos] + \
-                           html[start_pos + len(start_tag) : end_pos] + \
-                           html[end_pos + end_tag_len : ]
-                    next_process_pos = next_process_pos - len(start_tag) - \
-                                       end_tag_len
+            start_pos = tag['found'].pop()
+            for start_tag in tag['start_tags_to_strip']:
+                if html.startswith(start_tag, start_pos):
+                    if start_tag == tag['compound_start_tag_start']:
+                        start_tag_end_pos = HtmlCleanupHelper._find_tag_end(
+                            html, start_pos, tag_name)
+                    else:
+                        start_tag_end_pos = start_pos + len(start_tag)
+                    # Mark corresponding start/end tags for deletion.
+                    remove_spans.append((start_pos, start_tag_end_pos, ''))
+                    remove_spans.append((end_pos, match.end(), ''))
                     break
 
-        if found and not tag_contents:
-            # We have unmatched start tags; we can assume that we matched
-            # other start tags up with the right end tags, though. Also, we
-            # wanted to remove all tags like this, so just silently remove
-            # these start tags.
-            while found:
-                start_pos = found.pop()
-                # Doublecheck. This must always be true.
-                if html[start_pos : start_pos + len(simple_start_tag)] \
-                   == simple_start_tag:
-                    html = html[:start_pos] + \
-                           html[start_pos + len(simple_start_tag) : ]
-                elif html[start_pos : start_pos
-                          + len(compound_start_tag_start)] \
-                          == compound_start_tag_start:
-                    start_tag_end_pos = html.find('>', start_pos
-                                                  + len(compound_start_tag_start))
-                    if start_tag_end_pos == -1:
-                        # Impossible.
-                        raise Exception('No ">" character found for ' + tag_name
-                                        + ' tag.')
-                    # Check if the '>' is really the end of the start tag, and
-                    # not in the middle of some quoted value.
-                    start_tag =  html[start_pos :
-                                      start_tag_end_pos - start_pos + 1]
-                    if start_tag.count('"') % 2 or start_tag.count("'") % 2:
-                        # Ain't nobody got time for this.
-                        raise Exception('Unsupported ">" character found in '
-                                        'quoted attribute value of' + tag_name +
-                                        ' tag.')
-                    if start_tag.count('<'):
-                        # Or this. (Possible that a '>' went missing?)
-                        raise Exception('Unsupported "<" character found inside'
-                                        + tag_name + ' tag, or no ">" found.')
-                    html = html[:start_pos] + \
-                           html[start_pos + len(start_tag) : ]
-
-        return html
+        for tag_name in tags:
+            tag = tags[tag_name]
+            if tag['found'] and not tag['contents']:
+                # We have unmatched start tags; we can assume that we matched
+                # other start tags up with the right end tags, though. Also, we
+                # wanted to remove all tags like this, so just silently remove
+                # these start tags.
+                for start_pos in tag['found']:
+                    # Doublecheck. This must always be true.
+                    if html.startswith(tag['simple_start_tag'], start_pos):
+                        remove_spans.append(
+                            (start_pos,
+                             start_pos + len(tag['simple_start_tag']), ''))
+                    elif html.startswith(tag['compound_start_tag_start'],
+                                         start_pos):
+                        remove_spans.append(
+                            (start_pos, HtmlCleanupHelper._find_tag_end(
+                                html, start_pos, tag_name), ''))
+
+        return HtmlCleanupHelper._replace_spans(html, remove_spans)
+
+    @staticmethod
+    def fix_misnested_tags(html, tag_pairs):
+        """Fix inline tags which are opened just outside a block-level tag.
+
+        MS FrontPage outputs things like <b><p> ... </b> ... </p>. If we leave
+        this, BeautifulSoup will put a </p> before the </b>, which messes up
+        formatting. This method moves the inline start tag to just inside the
+        block-level start tag: <p><b> ... </b> ... </p>.
+
+        tag_pairs: a list of (inline tag name, block tag name) tuples, e.g.
+        [('b', 'p'), ('font', 'center')].
+
+        A start tag is only moved if it is directly followed (disregarding
+        whitespace) by the block-level start tag, and if its end tag comes
+        before the block-level end tag. Start tags of the inline tag may
+        contain attributes.
+
+        returns: changed html.
+        """
+        inline_names = {}
+        block_names = {}
+        for (inline_name, block_name) in tag_pairs:
+            inline_names.setdefault(inline_name, []).append(block_name)
+            block_names[block_name] = True
+        if not inline_names:
+            return html
+
+        # Tokenize the document once; we only need to see the start/end tags
+        # of the tag names we're interested in. Group 1 is '/' for end tags;
+        # group 2 is the tag name.
+        names = set(inline_names.keys()).union(block_names.keys())
+        rx_tags = re.compile(
+            '<(/?)(' + '|'.join([re.escape(name) for name in names])
+            + r')(?=[\s/>])[^>]*>')
+
+        # Stack of open inline tags per tag name. Every entry is a dict with
+        # the position of the inline start tag and, if it's directly followed
+        # by a block-level start tag, the position of that tag.
+        open_tags = {}
+        for name in inline_names:
+            open_tags[name] = []
+        # Candidates (stack entries with a block-level tag) which are still
+        # open, per block-level tag name. These get invalidated when the
+        # block-level tag is closed before the inline tag is.
+        open_candidates = {}
+        for name in block_names:
+            open_candidates[name] = []
+        # Inline start tag which was just found, whose next token we still need
+        # to inspect.
+        previous = None
+        replacements = []
+        # Positions of the start tags which are moved. A tag name can be the
+        # block-level tag of one pair and the inline tag of another; then the
+        # same start tag can be part of two swaps, which we can't both do.
+        # (Each swap only spans two tags and whitespace, so swaps overlap
+        # exactly if they share a tag.)
+        moved = set()
+        for match in rx_tags.finditer(html):
+            name = match.group(2)
+            if match.group(1):
+                # End tag.
+                if name in block_names:
+                    for entry in open_candidates[name]:
+                        entry['block_start'] = None
+                    open_candidates[name] = []
+                if name in open_tags and open_tags[name]:
+                    entry = open_tags[name].pop()
+                    if (entry['block_start'] is not None and
+                            entry['start'] not in moved and
+                            entry['block_start'] not in moved):
+                        # Swap the inline and the block-level start tag (and
+                        # the whitespace before the latter).
+                        moved.add(entry['start'])
+                        moved.add(entry['block_start'])
+                        replacements.append((
+                            entry['start'], entry['block_end'],
+                            html[entry['end'] : entry['block_end']]
+                            + html[entry['start'] : entry['end']]))
+                        entry['block_start'] = None
+                previous = None
+                continue
+
+            # Start tag.
+            if (previous is not None and name in inline_names[previous['name']]
+                    and html[previous['end'] : match.start()].strip() == ''):
+                previous['block_start'] = match.start()
+                previous['block_end'] = match.end()
+                open_candidates[name].append(previous)
+            previous = None
+            if name in inline_names:
+                previous = {
+                    'name': name,
+                    'start': match.start(),
+                    'end': match.end(),
+                    'block_start': None,
+                }
+                open_tags[name].append(previous)
+
+        return HtmlCleanupHelper._replace_spans(html, replacements)
+
+    @staticmethod
+    def normalize_attributes(html, tag_names, get_normalized_attribute):
+        """Change/remove attributes of certain tags, before parsing the HTML.
+
+        This can remove most 'attribute noise' before BeautifulSoup needs to
+        deal with it. The rules for changing attributes are not defined here;
+        they are provided by a function. (We use
+        SoupCleanupHelper.get_normalized_attribute(), so that the rules are the
+        same as those applied to the parsed document, and it's no problem if
+        those are applied again.)
+
+        tag_names: list of names of tags whose attributes are normalized. Tags
+        are matched case insensitively.
+        get_normalized_attribute: function which gets called with arguments
+        (tag_name, attribute_name, value) - the first two lowercased - and
+        returns the new value, or '' if the attribute should be removed.
+
+        Tags which we don't understand (like ones with a '>' inside unquoted
+        attribute values) and attributes without value are left alone.
+
+        returns: changed html.
+        """
+        if not tag_names:
+            return html
+        rx_tag = re.compile(
+            '<(' + '|'.join([re.escape(name) for name in tag_names]) + ')('
+            + HtmlCleanupHelper.rx_attributes_src + r')(\s*/?>)', re.I)
+
+        replacements = []
+        for match in rx_tag.finditer(html):
+            if not match.group(2):
+                continue
+            tag_name = match.group(1).lower()
+            changed = False
+            attributes = []
+            for attr in HtmlCleanupHelper.rx_attribute.finditer(match.group(2)):
+                (space, name, equals, value) = attr.groups()
+                if equals:
+                    quote = value[0] if value[0] in '"\'' else ''
+                    orig_value = value[1:-1] if quote else value
+                    value = get_normalized_attribute(tag_name, name.lower(),
+                                                     orig_value)
+                    if value != orig_value:
+                        changed = True
+                        if not value:
+                            continue
+                        # Add (different) quotes if necessary.
+                        if not quote or quote in value:
+                            quote = "'" if '"' in value else '"'
+                        attributes.append(space + name + equals + quote + value
+                                          + quote)
+                        continue
+                attributes.append(attr.group())
+            if changed:
+                replacements.append((match.start(2), match.end(2),
+                                     ''.join(attributes)))
+
+        return HtmlCleanupHelper._replace_spans(html, replacements)
+
+    @staticmethod
+    def _find_tag_end(html, start_pos, tag_name):
+        """Return the position just after the end of a start tag.
+
+        start_pos is the position of the '<'. We're not a real parser, so we
+        throw exceptions for things we cannot be sure about.
+        """
+        start_tag_end_pos = html.find('>', start_pos + len(tag_name) + 2)
+        if start_tag_end_pos == -1:
+            # Impossible.
+            raise Exception('No ">" character found for ' + tag_name
+                            + ' tag.')
+        # Check if the '>' is really the end of the start tag, and not in the
+        # middle of some quoted value.
+        start_tag = html[start_pos : start_tag_end_pos + 1]
+        if start_tag.count('"') % 2 or start_tag.count("'") % 2:
+            # Ain't nobody got time for this.
+            raise Exception('Unsupported ">" character found in '
+                            'quoted attribute value of' + tag_name +
+                            ' tag.')
+        if start_tag.count('<') > 1:
+            # Or this. (Possible that a '>' went missing?)
+            raise Exception('Unsupported "<" character found inside'
+                            + tag_name + ' tag, or no ">" found.')
+        return start_tag_end_pos + 1
+
+    @staticmethod
+    def _replace_spans(html, spans):
+        """Replace a number of position ranges in a string.
+
+        spans: list of (start, end, replacement) tuples. The ranges must not
+        overlap, but don't need to be sorted. The new string is constructed
+        with one join, instead of re-copying the html for every changed range.
+        """
+        if not spans:
+            return html
+        spans.sort()
+        parts = []
+        pos = 0
+        for (start, end, replacement) in spans:
+            assert start >= pos, 'Overlapping spans to replace.'
+            parts.append(html[pos : start])
+            parts.append(replacement)
+            pos = end
+        parts.append(html[pos : ])
+        return ''.join(parts)
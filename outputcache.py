@@ -0,0 +1,130 @@
+"""Helper class for caching cleaned-up output on disk.
+
+The OutputCache class stores output keyed on the contents of the input document
+plus a fingerprint of the cleanup (configuration and code version; see
+DocumentCleaner.get_fingerprint()). So re-running a cleanup over a site where
+only a few documents have changed, only needs to clean those documents.
+
+The cache is a directory with one file per output, which can be used by several
+processes at once.
+"""
+
+import hashlib
+import os
+import tempfile
+
+
+class OutputCache(object):
+    """A directory with cleaned-up output, keyed on input and fingerprint.
+
+    It has a maximum size; when it gets larger, the least recently used
+    items are removed. It also counts hits and misses, so you can check
+    whether it's useful.
+    """
+
+    def __init__(self, directory, max_size=None):
+        """Use a cache directory; it is created if necessary.
+
+        max_size is the maximum total size of the cached files in bytes; None
+        means no maximum. It is only checked by evict(), because that needs to
+        look at all files; it is not called automatically.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            self._make_dirs(directory)
+
+    @staticmethod
+    def _make_dirs(directory):
+        """Create a directory, which another process may be creating too."""
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+    @staticmethod
+    def get_key(html, fingerprint):
+        """Return the key for a document and a cleanup fingerprint."""
+        sha = hashlib.sha1(fingerprint)
+        sha.update('\0')
+        sha.update(html)
+        return sha.hexdigest()
+
+    def _get_path(self, key):
+        """Return the file name for a key."""
+        # Use subdirectories, so that directories do not get too large.
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def get(self, key, default=None):
+        """Return the output for key (and mark it as recently used)."""
+        path = self._get_path(key)
+        try:
+            with open(path, 'rb') as file_handle:
+                value = file_handle.read()
+        except IOError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        # The modification time is the 'last used' time for evict().
+        try:
+            os.utime(path, None)
+        except OSError:
+            # evict() may have just removed it; never mind.
+            pass
+        return value
+
+    def set(self, key, value):
+        """Store output for key."""
+        path = self._get_path(key)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            self._make_dirs(directory)
+        # Write to a temporary file first and then rename it, so that other
+        # processes never read a half written file.
+        (handle, temp_path) = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(handle, 'wb') as file_handle:
+                file_handle.write(value)
+            os.rename(temp_path, path)
+        except:
+            os.remove(temp_path)
+            raise
+
+    def evict(self):
+        """Remove least recently used items until the cache is small enough.
+
+        Returns the number of removed items.
+        """
+        if self.max_size is None:
+            return 0
+        files = []
+        total_size = 0
+        for dir_path, dir_names, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+        removed = 0
+        files.sort()
+        for mtime, size, path in files:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+            removed += 1
+        return removed
+
+    def get_stats(self):
+        """Return statistics as a dictionary."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'max_size': self.max_size}
@@ -66,18 +66,63 @@ Generally, recommended for any of the 4 kinds of whitespace:
   unnecessary cruft.
 """
 
+import copy
 import re
+from collections import OrderedDict
 from BeautifulSoup import Tag, NavigableString
 
 
+class LruCache(object):
+    """A dictionary with limited size, which forgets least recently used items.
+
+    It also counts hits and misses, so you can check whether it's useful.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        """Return the value for key (and mark it as recently used)."""
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._items[key] = value
+        return value
+
+    def set(self, key, value):
+        """Store a value; forget the least recently used one if necessary."""
+        self._items.pop(key, None)
+        self._items[key] = value
+        if len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        """Forget all values, and reset the statistics."""
+        self._items.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def get_stats(self):
+        """Return statistics as a dictionary."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._items), 'max_size': self.max_size}
+
+
 class SoupCleanupHelper(object):
     """Utility methods for HTML Cleanup using BeautifulSoup."""
 
     # Regular expressions we use more often are defined as class members, so we
     # don't need to recompile them every time. I hope that makes sense.
     #
-    rx_find_tag = re.compile(r'^\<([^\ >]+)')
-    #
     # Regexes containing HTML tags. These can be used for matching:
     # - an element that you don't know is a tag or NavigableString;
     # - the full text representation of a tag.
@@ -119,10 +164,22 @@ class SoupCleanupHelper(object):
     rx_multinbspace_not_at_start = re.compile(
         r'(\S)(?<!\&nbsp\;)((?:\s|(?<!\;)\&nbsp\;(?!\&nbsp\;)){2,})')
 
-    def __init__(self, soup):
+    # Normalized values of 'style' and 'class' attributes, by tag name,
+    # attribute name, value, type of value and version of the removal rules.
+    # The same values are often used all over a website, so this is shared by
+    # all instances; values are remembered while processing several documents
+    # in a row. (The type is part of the key because we are called with byte
+    # strings before parsing and with unicode strings after; 'x' == u'x', but
+    # a unicode value must not end up in a byte string or vice versa.)
+    normalized_values = LruCache(10000)
+    # Versions for all removal rules seen by any instance, by their contents.
+    _removal_rules_versions = {}
+
+    def __init__(self, soup=None):
         # Class variables / settings:
 
-        # BeautifulSoup instance.
+        # BeautifulSoup instance. (This can be set later; some methods don't
+        # need it.)
         self.soup = soup
 
         # Names of 'inline' tags; used to determine if
@@ -169,12 +226,27 @@ class SoupCleanupHelper(object):
             'h3': {'color' : '#999900'},
         }
 
+        # Index of tag name -> tags, for find_tags(). Built on first use, for
+        # the soup it was built for.
+        self._tag_index = None
+        self._tag_index_soup = None
+
+        # Lookup tables compiled from remove_attributes / remove_styles; see
+        # update_removal_rules(). The version identifies the rules; it is the
+        # same for all helpers with the same rules.
+        self._removal_rules_source = None
+        self._removal_rules_version = None
+        self.update_removal_rules()
+
     @staticmethod
     def regex_search(element, regex):
         """Check if element matches regex.
 
         This is a 'safe' replacement for rx.search(str(e)) where no error will
-        be thrown regardless whether element is a tag or NavigableString.
+        be thrown regardless whether element is a tag or NavigableString. It is
+        not used anymore by this class, because it serializes the full element
+        (and returns None for any non-ASCII content). Use is_whitespace() or
+        search_string() instead.
         """
         # Difficulty here: str(ee) may give UnicodeEncodeError with some
         # characters and so may ee.__str__() and repr(ee) (the latter with some
@@ -189,51 +261,417 @@ class SoupCleanupHelper(object):
             return None
         return regex.search(str(element))
 
+    def is_whitespace(self, element, including_br=False):
+        """Check if an element is whitespace (also if that is non-breaking).
+
+        This checks NavigableStrings and, if including_br is True, <br> tags.
+        (Only plain <br> without attributes; those are the ones we can move
+        around / remove without thinking.) Any other tag is not whitespace;
+        we never look at its contents, so this is cheap for large tags. Strings
+        are checked directly, not through their serialized version, and the
+        check stops at the first non-whitespace character.
+        """
+        if element.__class__ is NavigableString:
+            return self.rx_nbspace_only.match(element) is not None
+        return (including_br and element.__class__ is Tag and
+                element.name == 'br' and not element.attrs)
+
+    @staticmethod
+    def search_string(element, regex):
+        """Search a regex in an element, if that is a NavigableString.
+
+        Returns None for tags (and anything else that is not a string). The
+        regex is applied to str(element) i.e. an UTF-8 encoded string, like
+        all our other string manipulation code uses.
+        """
+        if element.__class__ is NavigableString:
+            return regex.search(str(element))
+        return None
+
     @staticmethod
     def get_index_in_parent(element):
         """Return the index of an element inside parent contents.
 
-        (Maybe there is a better way than this; I used to have this in a patched
-        version of the BeautifulSoup.py library 3.1.0.1 itself, before I started
-        working with the non-buggy v3.0.8.1. So I just took the function out and
-        didn't look further.)
+        BeautifulSoup has no index of an element's position; finding it means
+        scanning the parent's contents, which makes any loop over the children
+        of a wide parent (e.g. thousands of paragraphs in <body>) quadratic.
+        So we remember a 'hint' in every element we looked up: the index we
+        found and the parent's net number of insertions minus removals (done
+        through this class) at that time. If all those changes happened before
+        the element, which is the common case when processing elements in
+        document order, the hint still tells the exact index; if they happened
+        after, the old index is still right. Otherwise we scan the parent once
+        and refresh the hints of all its children, so a series of lookups in
+        the same parent stays linear in total.
+
+        The hint is always checked, so changes made to the tree through
+        BeautifulSoup directly never cause wrong results; they only make the
+        next lookup slower.
         """
-        index = 0
-        while index < len(element.parent.contents):
-            if element.parent.contents[index] is element:
-                return index
-            index = index + 1
-        # If this happens, something is really wrong with the data structure:
-        raise Exception('Internal fatal error: Could not find element back '
-                        'inside its own parent!?:' + str(element))
-
-    def get_tag_name(self, element):
+        parent = element.parent
+        contents = parent.contents
+        delta = parent.__dict__.get('_index_delta', 0)
+        hint = element.__dict__.get('_index_hint')
+        if hint is not None and hint[0] is parent:
+            for index in (hint[1] + delta - hint[2], hint[1]):
+                if 0 <= index < len(contents) and contents[index] is element:
+                    element.__dict__['_index_hint'] = (parent, index, delta)
+                    return index
+        elif contents and contents[0] is element:
+            # Shortcut for e.g. moving all contents out of a tag, one by one.
+            element.__dict__['_index_hint'] = (parent, 0, delta)
+            return 0
+
+        found = None
+        for index, child in enumerate(contents):
+            child.__dict__['_index_hint'] = (parent, index, delta)
+            if child is element:
+                found = index
+        if found is None:
+            # If this happens, something is really wrong with the data
+            # structure:
+            raise Exception('Internal fatal error: Could not find element back '
+                            'inside its own parent!?:' + str(element))
+        return found
+
+    @staticmethod
+    def _contents_changed(parent, delta):
+        """Register an insertion/removal inside parent.
+
+        This updates the index hints and forgets the child summary.
+        """
+        parent.__dict__['_index_delta'] = (
+            parent.__dict__.get('_index_delta', 0) + delta)
+        parent.__dict__.pop('_child_summary', None)
+
+    def _invalidate_line_info(self, parent, index):
+        """Forget line info that depends on the siblings around an index.
+
+        starts_rendered_line() and get_whitespace_destination() remember their
+        results in the tags they climb through; see there. Such a result only
+        depends on previous (or next) siblings of the tag and of its ancestors
+        up to the tag the climb ended at, and the climb only continues from a
+        tag which is the first (or last) child of its parent. So if the
+        elements at index - 1 and index became neighbors (or got a different
+        neighbor) the affected region is: the first-child chain starting at
+        the element at index, and the last-child chain starting at the element
+        before it.
+
+        The results for the tags in such a chain are all the same as the
+        result for the tag at the top, so if that does not change (which we
+        can often tell without climbing) we keep them all. This must be called
+        when parent.contents is already changed; sibling links may not be.
+        """
+        contents = parent.contents
+        if index < len(contents):
+            element = contents[index]
+            info = element.__dict__
+            if '_whitespace_anchor_before' in info or '_line_start' in info:
+                if index:
+                    previous = contents[index - 1]
+                else:
+                    previous = None
+                keys = []
+                anchor = info.get('_whitespace_anchor_before')
+                if anchor is not None and (
+                        anchor is not element or
+                        (previous is None and self.is_inline(parent))):
+                    keys.append('_whitespace_anchor_before')
+                at_line_start = info.get('_line_start')
+                if at_line_start is not None:
+                    if previous is not None:
+                        at_line_start_now = (self.is_tag(previous) and
+                                             not self.is_inline(previous))
+                    elif not self.is_inline(parent):
+                        at_line_start_now = True
+                    else:
+                        at_line_start_now = None
+                    if at_line_start_now != at_line_start:
+                        keys.append('_line_start')
+                self._forget_line_info(element, keys, 0)
+        if 0 < index <= len(contents):
+            element = contents[index - 1]
+            anchor = element.__dict__.get('_whitespace_anchor_after')
+            if anchor is not None and (
+                    anchor is not element or
+                    (index == len(contents) and self.is_inline(parent))):
+                self._forget_line_info(element, ['_whitespace_anchor_after'],
+                                       -1)
+
+    @staticmethod
+    def _forget_line_info(element, keys, child_index):
+        """Remove line info from the first/last-child chain of an element.
+
+        A climb remembers its result in every tag it passes, so if a tag in
+        the chain has nothing remembered, the tags below it don't either.
+        """
+        while keys and element.__class__ is Tag:
+            info = element.__dict__
+            keys = [key for key in keys if info.pop(key, None) is not None]
+            if not element.contents:
+                break
+            element = element.contents[child_index]
+
+    def insert(self, parent_tag, index, element):
+        """Insert an element into a tag, at the specified index.
+
+        This does the same as parent_tag.insert(index, element) but also
+        maintains the index hints (see get_index_in_parent()) and the line
+        info remembered by starts_rendered_line(), and does not scan the
+        element's old parent for the element's position, like BeautifulSoup
+        does when the element is moved from somewhere else.
+        Please use this (and the methods below) instead of the BeautifulSoup
+        methods, to keep all operations on wide tags fast.
+        """
+        if not isinstance(element, NavigableString) and isinstance(element,
+                                                                    basestring):
+            element = NavigableString(element)
+        index = min(index, len(parent_tag.contents))
+        if getattr(element, 'parent', None) is not None:
+            if (element.parent is parent_tag and
+                    self.get_index_in_parent(element) < index):
+                # Moving the element further down its own parent; its
+                # destination index shifts when we remove it.
+                index = index - 1
+            self.extract(element)
+        parent_tag.insert(index, element)
+        self._contents_changed(parent_tag, 1)
+        # The element has new neighbors, and so do its old neighbors.
+        self._invalidate_line_info(parent_tag, index)
+        self._invalidate_line_info(parent_tag, index + 1)
+        element.__dict__['_index_hint'] = (
+            parent_tag, index, parent_tag.__dict__['_index_delta'])
+        self._index_new_tags(element)
+        return element
+
+    def insert_before(self, element, new_element):
+        """Insert an element just before another element."""
+        return self.insert(element.parent, self.get_index_in_parent(element),
+                           new_element)
+
+    def insert_after(self, element, new_element):
+        """Insert an element just after another element."""
+        return self.insert(element.parent,
+                           self.get_index_in_parent(element) + 1, new_element)
+
+    def extract(self, element):
+        """Remove an element from the document; return it.
+
+        Same as element.extract(), but using / maintaining index hints and
+        line info.
+        """
+        parent = element.parent
+        if parent is not None:
+            index = self.get_index_in_parent(element)
+            del parent.contents[index]
+            self._contents_changed(parent, -1)
+            self._invalidate_line_info(parent, index)
+            # BeautifulSoup's extract() now only relinks the element's
+            # neighbors, without searching its parent.
+            element.parent = None
+        return element.extract()
+
+    def replace_with(self, element, replacement):
+        """Replace an element by another element or a string."""
+        parent = element.parent
+        index = self.get_index_in_parent(element)
+        self.extract(element)
+        return self.insert(parent, index, replacement)
+
+    def find_tags(self, names):
+        """Return all tags with the given name(s), in document order.
+
+        This returns the same as self.soup.findAll(names), for one tag name or
+        a list of names, without walking the whole document every time. The
+        first call indexes all tags in the document by name; after that,
+        tags inserted through insert() (and the methods using it) are added
+        to the index, and tags that are not inside the document anymore are
+        dropped from it when their name is looked up again. So the cost of a
+        call depends on the number of tags with the given name(s), not on the
+        size of the document.
+
+        New tags added to the document through BeautifulSoup methods directly
+        are not found.
+        """
+        if self._tag_index_soup is not self.soup:
+            self._tag_index = {}
+            self._tag_index_soup = self.soup
+            for element in self.soup.recursiveChildGenerator():
+                if element.__class__ is Tag:
+                    self._add_to_tag_index(element)
+        if isinstance(names, basestring):
+            names = [names]
+
+        # Since tags may have been moved around, (re)determine the order.
+        positioned_tags = []
+        known_positions = {id(self.soup): ()}
+        for name in names:
+            tags = self._tag_index.get(name)
+            if tags:
+                live_tags = []
+                for tag in tags:
+                    position = self._get_document_position(tag,
+                                                           known_positions)
+                    if position is None:
+                        del tag.__dict__['_tag_index']
+                    else:
+                        live_tags.append(tag)
+                        positioned_tags.append((position, tag))
+                tags[:] = live_tags
+        positioned_tags.sort(key=lambda positioned_tag: positioned_tag[0])
+        return [tag for position, tag in positioned_tags]
+
+    def visit(self, handlers, root=None):
+        """Call functions for elements, in one traversal of the document.
+
+        This is meant for combining several 'for tag in soup.findAll(name)'
+        loops into one pass, if processing a tag does not depend on other
+        tags being processed first. handlers is a dict with tag names and/or
+        classes of other elements (e.g. Comment) as keys, and lists of
+        functions as values. Every function gets called with the element. It
+        may change or remove the element (but nothing else in the document),
+        or replace it by a new element; in that case it must return the new
+        element. Further functions are called with the new element, and after
+        that, the contents of the element are traversed. Elements that were
+        removed are not traversed further.
+
+        Traversal is depth-first (i.e. in document order), starting from the
+        contents of root; default is the whole soup.
+        """
+        if root is None:
+            root = self.soup
+        stack = list(reversed(root.contents))
+        while stack:
+            element = stack.pop()
+            if element.__class__ is Tag:
+                key = element.name
+            else:
+                key = element.__class__
+            for function in handlers.get(key, ()):
+                new_element = function(element)
+                if new_element is not None:
+                    element = new_element
+                if element.parent is None:
+                    break
+            if element.__class__ is Tag and element.parent is not None:
+                stack.extend(reversed(element.contents))
+
+    def _add_to_tag_index(self, tag):
+        """Add a tag to the tag name index; mark it as being indexed."""
+        tag.__dict__['_tag_index'] = self._tag_index
+        self._tag_index.setdefault(tag.name, []).append(tag)
+
+    def _index_new_tags(self, element):
+        """Add an inserted tag, and new tags inside it, to the tag index.
+
+        (Tags that were just moved inside the document are indexed already.)
+        """
+        if (self._tag_index_soup is not None and element.__class__ is Tag and
+                element.__dict__.get('_tag_index') is not self._tag_index):
+            self._add_to_tag_index(element)
+            for child in element.recursiveChildGenerator():
+                if (child.__class__ is Tag and child.__dict__.get(
+                        '_tag_index') is not self._tag_index):
+                    self._add_to_tag_index(child)
+
+    def _get_document_position(self, element, known_positions):
+        """Return the position of an element inside the document.
+
+        The position is a tuple of indexes (inside parent contents) of all
+        ancestors from the top down, and the element itself; comparing two
+        positions tells which element comes first. Returns None if the element
+        is not inside self.soup.
+
+        known_positions is a dict of id(element) -> position, which must
+        contain at least the soup itself and is extended with the element and
+        all its ancestors. (So it may only be reused as long as nothing in the
+        document changes.)
+        """
+        ancestors = []
+        while id(element) not in known_positions:
+            ancestors.append(element)
+            element = element.parent
+            if element is None:
+                # Top reached without seeing the soup: not in the document.
+                for element in ancestors:
+                    known_positions[id(element)] = None
+                return None
+        position = known_positions[id(element)]
+        if position is not None:
+            for element in reversed(ancestors):
+                position = position + (self.get_index_in_parent(element),)
+                known_positions[id(element)] = position
+        return position
+
+    @staticmethod
+    def get_tag_name(element):
         """Return the tag name of an element (or '' if this is not a tag).
 
-        I was surprised I can't find a function like this in BeautifulSoup...
+        Also '' for the BeautifulSoup object itself. This (like the other is_*
+        methods below) only looks at the element itself, never at its contents,
+        so it's cheap to call for large tags.
         """
-        if element.__class__.__name__ != 'Tag':
-            return ''
-        m = self.regex_search(element.__repr__(), self.rx_find_tag)
-        if m:
-            return m.group(1)
+        if element.__class__ is Tag:
+            return element.name
         return ''
 
+    @staticmethod
+    def is_tag(element):
+        """Check if an element is a tag (and not the BeautifulSoup object)."""
+        return element.__class__ is Tag
+
+    @staticmethod
+    def is_string(element):
+        """Check if an element is a NavigableString.
+
+        Subclasses (Comment, Declaration, ...) don't count; those are never
+        treated as text.
+        """
+        return element.__class__ is NavigableString
+
+    def is_inline(self, element):
+        """Check if an element is an inline tag."""
+        return (element.__class__ is Tag and
+                element.name in self.inline_tag_names)
+
     @staticmethod
     def get_style_properties(tag):
         """Get style attribute from tag, return it as dictionary of properties.
 
-        Keys always lowercase.
+        Keys always lowercase; the dictionary is ordered like the attribute.
+        The parsed properties are kept with the tag, so the attribute is not
+        parsed again as long as it does not change. The returned dictionary
+        may be changed, but set_style_properties() must be called afterwards,
+        to update the attribute.
         """
         style_attr = tag.get('style')
-        properties = {}
+        parsed = tag.__dict__.get('_style_properties')
+        if parsed is not None and parsed[0] is style_attr:
+            return parsed[1]
+        properties = OrderedDict()
         if style_attr:
             for property_def in style_attr.split(';'):
                 if property_def.strip() != '':
                     (name, value) = property_def.split(':', 1)
                     properties[name.strip().lower()] = value.strip()
+        tag.__dict__['_style_properties'] = (style_attr, properties)
         return properties
 
+    @staticmethod
+    def set_style_properties(tag, properties):
+        """Set style attribute in a tag, from a dictionary of properties.
+
+        If the dictionary is empty, the attribute is deleted.
+        """
+        if properties:
+            style_attr = '; '.join([name + ': ' + properties[name]
+                                    for name in properties])
+            tag['style'] = style_attr
+        else:
+            style_attr = None
+            del tag['style']
+        tag.__dict__['_style_properties'] = (style_attr, properties)
+
     @staticmethod
     def set_style_property(tag, set_name, set_value):
         """Set style attribute (property=value) in a tag.
@@ -242,49 +680,13 @@ class SoupCleanupHelper(object):
         set_value must be string type. If set_value == '' the property is
         deleted.
         """
-        style_attr = tag.get('style')
-        properties = {}
+        properties = SoupCleanupHelper.get_style_properties(tag)
         set_name = set_name.strip().lower()
-
-        # Deconstruct style.
-        if style_attr:
-            for property_def in style_attr.split(';'):
-                (name, value) = property_def.split(':', 1)
-                properties[name.strip().lower()] = value.strip()
-
-            # (Re)build style_attr from here.
-            if set_name in properties:
-                # Property was present already. Re-compose the full style
-                # attribute.
-                if set_value != '':
-                    properties[set_name] = set_value
-                else:
-                    del properties[set_name]
-                style_attr = ''
-                for name in properties:
-                    if style_attr != '':
-                        style_attr += '; '
-                    style_attr += name + ': ' + properties[name]
-            elif set_value != '':
-                # Add the property to the existing style attribute.
-                style_attr = style_attr.strip()
-                if style_attr != '':
-                    if not style_attr.endswith(';'):
-                        style_attr += ';'
-                    style_attr += ' '
-                style_attr += set_name + ': ' + set_value
-        else:
-            style_attr = set_name + ': ' + set_value
-
-        # Set style (newly, or overwrite the existing one).
-        if style_attr != '':
-            tag['style'] = style_attr
-        #elif 'style' in tag.attrs: <-- wrong. attrs returns tuples, not keys.
-	#so just always 'del' it, regardless of existende.
-        else:
-            # There's no style left. (There may or may not have been a set_name;
-            # if there was, we just deleted it.)
-            del tag['style']
+        if set_value != '':
+            properties[set_name] = set_value
+        elif set_name in properties:
+            del properties[set_name]
+        SoupCleanupHelper.set_style_properties(tag, properties)
 
     def get_alignment(self, tag):
         """Get alignment from a tag.
@@ -352,84 +754,140 @@ class SoupCleanupHelper(object):
         A key "CHANGE" (which can only be set if allow_parent_change is
         non-empty) means the alignment of the parent tag should be changed to
         this value; the method does not always do this by itself.
+
+        Child tags are processed before their parent (because the parent's
+        alignment can change as a result), but not by recursing: we keep our
+        own stack of tags being processed, so that deeply nested documents
+        (e.g. tables inside tables inside tables) don't hit Python's recursion
+        limit.
+        """
+        stack = [self._start_check_alignment(parent_tag, parent_align,
+                                             allow_parent_change)]
+        while True:
+            state = stack[-1]
+            if state['children']:
+                # Process the next child tag (and its children) first.
+                tag = state['children'].pop()
+                tag_name = self.get_tag_name(tag)
+                tag_alignment = self.get_alignment(tag)
+                if tag_alignment:
+                    current_alignment = tag_alignment
+                    allow_change = 'any'
+                elif tag_name == 'center':
+                    current_alignment = 'center'
+                    allow_change = state['align']
+                else:
+                    current_alignment = state['align']
+                    if tag_name == 'p':
+                        allow_change = 'any'
+                    else:
+                        allow_change = ''
+                state['child'] = (tag, tag_name, tag_alignment)
+                stack.append(self._start_check_alignment(
+                    tag, current_alignment, allow_change))
+                continue
+
+            seen_alignments = self._finish_check_alignment(state)
+            stack.pop()
+            if not stack:
+                return seen_alignments
+            self._apply_child_alignments(stack[-1], seen_alignments)
+    # Ideas for this method:
+    # - if all your stuff is 'center', and more than one (and not inherit), then
+    #   insert a 'center', place everything inside, and then delete all the
+    #   explicit align=center from these tags
+    # - replace 'middle' by 'center'? (align=middle is used for pictures, I've
+    #   seen sometimes.)
+
+    def _start_check_alignment(self, parent_tag, parent_align,
+                               allow_parent_change):
+        """Start checking alignments inside a tag, for check_alignment().
+
+        Returns the state of the check: a dict containing the tag and the
+        arguments, the alignments seen so far, and the child tags which still
+        need to be processed (in reverse order).
         """
         ## First: special handling for 'implicitly aligning tags', i.e. <center>
         if parent_align == 'center':
             # Get rid of all 'center' tags, because they do nothing. (We're
             # generally better off placing its child contents at the same level
             # now, so we can inspect them in one go.)
-            for tag in parent_tag.findAll('center', recursive=False):
+            summary = self.get_child_summary(parent_tag)
+            for tag in summary['tags_by_name'].get('center', []):
                 self.move_contents_before(tag, tag)
-                tag.extract()
+                self.extract(tag)
 
         seen_alignments = {}
         # Non-whitespace NavigableStrings always have alignment equal to the
         # parent element. (Whitespace strings don't matter; alignment can be
         # changed without visible difference.)
-        r = self.get_contents(parent_tag, 'nonwhitespace_string')
-        if r:
+        summary = self.get_child_summary(parent_tag)
+        if summary['strings']:
             # Setting 'inherit' effectively means: prevent parent's alignment
             # from being changed.
             seen_alignments['inherit'] = True
 
-        ## Find/index alignment of all tags within parent_tag, and process them.
-        for tag in parent_tag.findAll(recursive=False):
-
-            tag_name = self.get_tag_name(tag)
-            tag_alignment = self.get_alignment(tag)
-            if tag_alignment:
-                current_alignment = tag_alignment
-                allow_change = 'any'
-            elif tag_name == 'center':
-                current_alignment = 'center'
-                allow_change = parent_align
-            else:
-                current_alignment = parent_align
-                if tag_name == 'p':
-                    allow_change = 'any'
-                else:
-                    allow_change = ''
-
-            # Recurse through sub elements first.
-            child_alignments = self.check_alignment(tag, current_alignment, allow_change)
-            # Handling of 'implicitly aligning tags', i.e. <center>:
-            if tag_name == 'center':
-                if 'CHANGE' in child_alignments:
-                    # tag_alignment needs change -- which can (only) be done by
-                    # deleting the tag.
-                    self.move_contents_before(tag, tag)
-                    tag.extract()
+        children = list(summary['tags'])
+        children.reverse()
+        return {'tag': parent_tag,
+                'align': parent_align,
+                'allow_change': allow_parent_change,
+                'seen': seen_alignments,
+                'last_seen': None,
+                'children': children,
+                'child': None}
+
+    def _apply_child_alignments(self, state, child_alignments):
+        """Process a child tag's alignment, after its own children.
+
+        state is the state of the check of the child's parent (see
+        _start_check_alignment()); child_alignments are the alignments seen
+        inside the child.
+        """
+        tag, tag_name, tag_alignment = state['child']
+        ## Handling of 'implicitly aligning tags', i.e. <center>:
+        if tag_name == 'center':
+            if 'CHANGE' in child_alignments:
+                # tag_alignment needs change -- which can (only) be done by
+                # deleting the tag.
+                self.move_contents_before(tag, tag)
+                self.extract(tag)
+            return
 
+        ## 'Normal' element.
+        if 'CHANGE' in child_alignments:
+            # tag_alignment needs change. (We may end up deleting it just
+            # afterwards, but this way keeps code clean.)
+            self.set_alignment(tag, child_alignments['CHANGE'])
+            tag_alignment = child_alignments['CHANGE']
+
+        if tag_alignment:
+            ## Explicit/changed alignment.
+            if tag_alignment == state['align']:
+                # Delete (now-)superfluous explicit 'align' attribute.
+                self.set_alignment(tag, '')
+                state['seen']['inherit'] = True
             else:
-                # 'Normal' element.
-                if 'CHANGE' in child_alignments:
-                    # tag_alignment needs change. (We may end up deleting it
-                    # just afterwards, but this way keeps code clean.)
-                    self.set_alignment(tag, child_alignments['CHANGE'])
-                    tag_alignment = child_alignments['CHANGE']
-
-                if tag_alignment:
-                    ## Explicit/changed alignment.
-                    if tag_alignment == parent_align:
-                        # Delete (now-)superfluous explicit 'align' attribute.
-                        self.set_alignment(tag, '')
-                        seen_alignments['inherit'] = True
-                    else:
-                        # We're just collecting alignments 'not equal to
-                        # inherited' here; check after the loop what we want to
-                        # do about it.
-                        last_seen = tag_alignment
-                        seen_alignments[last_seen] = True
-                else:
-                    ## Inherited, unchanged alignment.
-                    seen_alignments['inherit'] = True
+                # We're just collecting alignments 'not equal to inherited'
+                # here; check after processing all children what we want to do
+                # about it.
+                state['last_seen'] = tag_alignment
+                state['seen'][tag_alignment] = True
+        else:
+            ## Inherited, unchanged alignment.
+            state['seen']['inherit'] = True
 
+    def _finish_check_alignment(self, state):
+        """Finish checking alignments inside a tag; return alignments seen."""
         ## After finding/indexing(/changing?) all alignments from (recursive?)
         ## child tags:
         #
         # We can change this collection of elements' (and thus the parent's)
         # alignment IF the parent's "align" property has no influence on any of
         # its children - i.e. no "inherit" was recorded.
+        seen_alignments = state['seen']
+        last_seen = state['last_seen']
+        allow_parent_change = state['allow_change']
         if (len(seen_alignments) == 1 and
             'inherit' not in seen_alignments and
             (allow_parent_change == 'any' or allow_parent_change == last_seen)):
@@ -437,16 +895,12 @@ class SoupCleanupHelper(object):
             # Indicate to caller that it should change parent's align attribute.
             seen_alignments['CHANGE'] = last_seen
             # Delete any explicit attribute because we will change the parent's.
-            for tag in parent_tag.findAll(align=last_seen, recursive=False):
+            for tag in [element for element in state['tag'].contents
+                        if element.__class__ is Tag and
+                        element.get('align') == last_seen]:
                 self.set_alignment(tag, '')
 
         return seen_alignments
-    # Ideas for this method:
-    # - if all your stuff is 'center', and more than one (and not inherit), then
-    #   insert a 'center', place everything inside, and then delete all the
-    #   explicit align=center from these tags
-    # - replace 'middle' by 'center'? (align=middle is used for pictures, I've
-    #   seen sometimes.)
 
     def mangle_attributes(self, tag):
         """Filter out attributes from a tag; change some others.
@@ -465,102 +919,193 @@ class SoupCleanupHelper(object):
         for orig_name in attr_names:
             orig_value = tag.get(orig_name)
             name = orig_name.lower()
-            value = orig_value.lower()
-
-            # Check if we should remove this attribute.
-            remove = False
-            if (tag_name in self.remove_attributes and
-                    name in self.remove_attributes[tag_name]):
-                if isinstance(self.remove_attributes[tag_name][name], list):
-                    remove = value in self.remove_attributes[tag_name][name]
-                else:
-                    remove = self.remove_attributes[tag_name][name] in [value, '*']
-            elif ('*' in self.remove_attributes and
-                  name in self.remove_attributes['*']):
-                if isinstance(self.remove_attributes['*'][name], list):
-                    remove = value in self.remove_attributes['*'][name]
-                else:
-                    remove = self.remove_attributes['*'][name] in [value, '*']
-            if remove:
-                value = ''
 
-            elif name == 'align':
+            if (name == 'align' and
+                    not self.attribute_is_removed(tag_name, name,
+                                                  orig_value.lower())):
                 # Replace deprecated align attribute by newer way. Unlike the
                 # below, this call already resets the 'align' attribute itself,
-                # so we do not reset 'value', in order to skip the below code
+                # so we do not change 'value', in order to skip the below code
                 # which changes attributes.
-                self.set_alignment(tag, value)
-
-            elif name == 'class':
-                classes = orig_value.split()
-                for value in classes:
-                    if value.lower() == 'msonormal':
-                        classes.remove(value)
-                value = ' '.join(classes)
-
-            elif name == 'style':
-                # Loop over style name/values; rebuild the attribute value from
-                # scratch.
-                value = ''
-                for property_def in orig_value.split(';'):
-                    if property_def.strip() != '':
-                        (p_name, p_value) = property_def.split(':', 1)
-                        p_name = p_name.strip()
-                        p_value = p_value.strip()
-                        # We want to keep case of style name/values but not for
-                        # comparison.
-                        l_p_name = p_name.lower()
-                        l_p_value = p_value.lower()
-
-                        # Check if we should remove this style.
-                        remove = False
-                        if (tag_name in self.remove_styles and
-                                l_p_name in self.remove_styles[tag_name]):
-                            if isinstance(
-                                    self.remove_styles[tag_name][l_p_name],
-                                    list):
-                                remove = l_p_value in \
-                                         self.remove_styles[tag_name][l_p_name]
-                            else:
-                                remove = self.remove_styles[tag_name][l_p_name]\
-                                         in [l_p_value, '*']
-                        elif ('*' in self.remove_styles and
-                              l_p_name in self.remove_styles['*']):
-                            if isinstance(
-                                    self.remove_styles['*'][l_p_name], list):
-                                remove = l_p_value in \
-                                         self.remove_styles['*'][l_p_name]
-                            else:
-                                remove = self.remove_styles['*'][l_p_name] in \
-                                         [l_p_value, '*']
-                        if remove:
-                            p_value = ''
-
-                        elif p_name.startswith('margin'):
-                            # Always remove small margins.
-                            if (p_value.isnumeric() and
-                                    float(p_value) < 0.02):
-                                p_value = ''
-
-                        elif p_name.startswith('mso-'):
-                            # Weird office specific styles? Never check, just
-                            # delete and hope they didn't do anything.
-                            p_value = ''
-
-                        # Re-add the style value, unless we discarded it.
-                        if p_value:
-                            if value != '':
-                                value += '; '
-                            value += p_name + ': ' + p_value
-
-            # Check if attributes have changed (but don't change case only);
-            # always change attribute names to lower case.
-            if name != orig_name or value != orig_value.lower():
+                value = orig_value
+                self.set_alignment(tag, value.lower())
+            else:
+                value = self.get_normalized_attribute(tag_name, name,
+                                                      orig_value)
+
+            # Check if attributes have changed; always change attribute names
+            # to lower case.
+            if name != orig_name or value != orig_value:
                 if name != orig_name or not value:
                     del tag[orig_name]
                 if value:
                     tag[name] = value
 
+    def update_removal_rules(self):
+        """Compile remove_attributes / remove_styles, if they have changed.
+
+        The nested dicts are easy to configure but slow to check for every
+        attribute / style property, so we convert them into lookup tables: per
+        tag name, a dict of all attribute (or style property) names which have
+        rules for that tag, including the ones for '*'. The values are True
+        (always remove) or a frozenset of values to remove.
+
+        This is called by all methods which check the rules, i.e.
+        get_normalized_attribute(), attribute_is_removed() and
+        style_property_is_removed(), so the settings can be changed at any
+        time. (Checking whether they have changed is cheap.)
+        """
+        if (self._removal_rules_source is None or
+                self._removal_rules_source[0] != self.remove_attributes or
+                self._removal_rules_source[1] != self.remove_styles):
+            self._removal_rules_source = (copy.deepcopy(self.remove_attributes),
+                                          copy.deepcopy(self.remove_styles))
+            self._removed_attributes = self._compile_removal_rules(
+                self.remove_attributes)
+            self._removed_styles = self._compile_removal_rules(
+                self.remove_styles)
+            rules_key = (self._get_removal_rules_key(self._removed_attributes),
+                         self._get_removal_rules_key(self._removed_styles))
+            self._removal_rules_version = \
+                SoupCleanupHelper._removal_rules_versions.setdefault(
+                    rules_key,
+                    len(SoupCleanupHelper._removal_rules_versions) + 1)
+
+    @staticmethod
+    def _compile_removal_rules(rules):
+        """Compile one two-dimensional dict of rules into lookup tables."""
+        compiled = {}
+        for tag_name in ['*'] + [key for key in rules if key != '*']:
+            # Tag specific rules override the ones for all tags.
+            compiled[tag_name] = dict(compiled.get('*', {}))
+            for name, values in rules.get(tag_name, {}).items():
+                if isinstance(values, list):
+                    compiled[tag_name][name] = frozenset(values)
+                elif values == '*':
+                    compiled[tag_name][name] = True
+                else:
+                    compiled[tag_name][name] = frozenset([values])
+        return compiled
+
+    @staticmethod
+    def _get_removal_rules_key(compiled):
+        """Return a (hashable) representation of compiled rules."""
+        return tuple(sorted(
+            (tag_name, tuple(sorted(
+                (name, rule if rule is True else tuple(sorted(rule)))
+                for name, rule in compiled[tag_name].items())))
+            for tag_name in compiled))
+
+    def get_settings_key(self):
+        """Return a (hashable) representation of all settings.
+
+        Helpers with equal keys do the same cleanup; this can be used for e.g.
+        caching output. (The representation does not depend on the order of
+        dicts, so the repr() of it is stable too.) It includes the removal
+        rules, so update_removal_rules() is called first.
+        """
+        self.update_removal_rules()
+        return (tuple(self.inline_tag_names), self.dedupe_nbsp,
+                self._get_removal_rules_key(self._removed_attributes),
+                self._get_removal_rules_key(self._removed_styles))
+
+    def attribute_is_removed(self, tag_name, name, value):
+        """Check if an attribute should be removed, according to our settings.
+
+        name and value are expected to be lowercase.
+        """
+        self.update_removal_rules()
+        rules = self._removed_attributes
+        rule = rules.get(tag_name, rules['*']).get(name)
+        return rule is not None and (rule is True or value in rule)
+
+    def get_normalized_attribute(self, tag_name, name, value):
+        """Return the normalized value of an attribute.
+
+        This contains the logic of mangle_attributes() that does not need the
+        tag itself, so it can also be used on attributes in an HTML string
+        before it is parsed. (See HtmlCleanupHelper.normalize_attributes().)
+        The 'align' attribute is not changed, only removed if our settings say
+        so; mangle_attributes() moves it into the 'style' attribute.
+
+        name is expected to be lowercase.
+
+        returns: the new value, or '' if the attribute should be removed.
+        """
+        # (Before using the version of the rules in the key.)
+        self.update_removal_rules()
+        if name == 'style' or name == 'class':
+            key = (tag_name, name, value, type(value),
+                   self._removal_rules_version)
+            normalized = self.normalized_values.get(key)
+            if normalized is None:
+                normalized = self._get_normalized_attribute(tag_name, name,
+                                                            value)
+                self.normalized_values.set(key, normalized)
+            return normalized
+        return self._get_normalized_attribute(tag_name, name, value)
+
+    def _get_normalized_attribute(self, tag_name, name, value):
+        """Return the normalized value of an attribute; see above."""
+        if self.attribute_is_removed(tag_name, name, value.lower()):
+            return ''
+
+        if name == 'class':
+            classes = value.split()
+            for class_name in classes:
+                if class_name.lower() == 'msonormal':
+                    classes.remove(class_name)
+            return ' '.join(classes)
+
+        if name == 'style':
+            # Loop over style name/values; rebuild the attribute value from
+            # scratch. We want to keep case of style name/values but not for
+            # comparison. If a property is defined more than once, only the
+            # last definition counts (like in CSS), so we collapse them before
+            # checking the rules; otherwise we could remove the definition that
+            # counts, and keep one that was overridden.
+            properties = OrderedDict()
+            for property_def in value.split(';'):
+                if property_def.strip() != '':
+                    (p_name, p_value) = property_def.split(':', 1)
+                    p_name = p_name.strip()
+                    properties.pop(p_name.lower(), None)
+                    properties[p_name.lower()] = (p_name, p_value.strip())
+            value = '; '.join([
+                p_name + ': ' + p_value
+                for l_p_name, (p_name, p_value) in properties.items()
+                if not self.style_property_is_removed(tag_name, l_p_name,
+                                                      p_value)])
+
+        return value
+
+    def style_property_is_removed(self, tag_name, name, value):
+        """Check if a style property should be removed.
+
+        This is the case if our settings say so, or if it is a small margin or
+        an MS Office specific property. Properties without value are always
+        removed.
+
+        name is expected to be lowercase.
+        """
+        self.update_removal_rules()
+        if not value:
+            return True
+        rules = self._removed_styles
+        rule = rules.get(tag_name, rules['*']).get(name)
+        if rule is not None and (rule is True or value.lower() in rule):
+            return True
+
+        if name.startswith('margin'):
+            # Always remove small margins. (isdigit() rather than isnumeric(),
+            # because that only exists for unicode strings and we can also be
+            # called before parsing.)
+            return value.isdigit() and float(value) < 0.02
+
+        # Weird office specific styles? Never check, just delete and hope they
+        # didn't do anything.
+        return name.startswith('mso-')
+
     def mangle_tag(self, tag):
         """Try to move all attributes out of the current tag.
 
@@ -602,10 +1147,10 @@ class SoupCleanupHelper(object):
         # the 'inline' tag.
         #
         # Find child non-space NavigableStrings(?): should find nothing.
-        r1 = self.get_contents(tag, 'nonwhitespace_string')
-        if not r1:
+        summary = self.get_child_summary(tag)
+        if not summary['strings']:
             # Find child tags: should find one tag.
-            r1 = self.get_contents(tag, 'tags')
+            r1 = summary['tags']
             if len(r1) == 1:
                 name = self.get_tag_name(r1[0])
                 if name in ['a', 'p', 'span', 'div', 'h2', 'h3', 'h4', 'li', 'blockquote']:
@@ -624,11 +1169,11 @@ class SoupCleanupHelper(object):
             # (XHTML specified that blockquote must contain block-level
             # elements. No more; in HTML it may contain just text.)
             if name in ['a', 'p', 'span', 'div', 'h2', 'h3', 'h4', 'li', 'blockquote']:
-                r1 = self.get_contents(parent_tag, 'tags')
-                if len(r1) == 1:
+                summary = self.get_child_summary(parent_tag)
+                if len(summary['tags']) == 1:
                     r1 = []
                     if tag_name != 'a':
-                        r1 = self.get_contents(parent_tag, 'nonwhitespace_string')
+                        r1 = summary['strings']
                     if not r1:
                         if not ((tag_name == 'a' or tag.get('id')) and
                                 parent_tag.get('id')):
@@ -644,7 +1189,7 @@ class SoupCleanupHelper(object):
                 # moment, we are just hoping that we have cleaned up all font
                 # tags where this is the case, above.
                 dest = Tag(self.soup, 'span')
-                parent_tag.insert(self.get_index_in_parent(tag), dest)
+                self.insert_before(tag, dest)
                 dest_is_new = True
             else:
                 # We cannot merge this tag into another one, but we'll also
@@ -657,13 +1202,13 @@ class SoupCleanupHelper(object):
                 # caller.)
                 if not tag.attrs and tag_name in ['span', 'div']:
                     self.move_contents_before(tag, tag)
-                    tag.extract()
+                    self.extract(tag)
                 return
 
         # Before we merge attributes, normalize their names/values.
         self.mangle_attributes(dest)
         merge_classes = ''
-        merge_styles = {}
+        merge_styles = OrderedDict()
         # Get the attributes (excl. style) and styles to merge into destination.
         if tag_name == 'font':
             # Iterate over attributes and convert them all into styles; don't
@@ -679,23 +1224,9 @@ class SoupCleanupHelper(object):
                 value = tag.get(orig_name)
                 style_name = ''
 
-                # Check if we should remove this attribute.
-                remove = False
-                if ('font' in self.remove_attributes and
-                        name in self.remove_attributes['font']):
-                    if isinstance(self.remove_attributes['font'][name], list):
-                        remove = value in self.remove_attributes['font'][name]
-                    else:
-                        remove = self.remove_attributes['font'][name] in [
-                            value, '*']
-                elif ('*' in self.remove_attributes and
-                      name in self.remove_attributes['*']):
-                    if isinstance(self.remove_attributes['*'][name], list):
-                        remove = value in self.remove_attributes['*'][name]
-                    else:
-                        remove = self.remove_attributes['*'][name] in [
-                            value, '*']
-                if remove:
+                # Check if we should remove this attribute. (Note the value
+                # is compared case sensitively, unlike in mangle_attributes().)
+                if self.attribute_is_removed('font', name, value):
                     # Fall through but also remove the tag, for the len() check.
                     del tag[name]
 
@@ -750,10 +1281,11 @@ class SoupCleanupHelper(object):
         # Merge classes into the destination.
         if merge_classes:
             # We know destination classes exist.
+            # (Attribute values are unicode; don't use str.lower.)
             classes = set(
-                map(str.lower, re.split(r'\s+', dest.get('class')))
+                [c.lower() for c in re.split(r'\s+', dest.get('class'))]
             ).union(set(
-                map(str.lower, re.split(r'\s+', merge_classes))
+                [c.lower() for c in re.split(r'\s+', merge_classes)]
             ))
             dest['class'] = ' '.join(classes)
 
@@ -765,14 +1297,8 @@ class SoupCleanupHelper(object):
                 # value into parent, or skip if the destination is the child.
                 if not (dest_is_child and name in dest_styles):
                     dest_styles[name] = merge_styles[name]
-            # Reconstruct the style attribute and put it back into the
-            # destination element.
-            style = ''
-            for name in dest_styles:
-                if style != '':
-                    style += '; '
-                style += name + ': ' + dest_styles[name]
-            dest['style'] = style
+            # Put the style attribute back into the destination element.
+            self.set_style_properties(dest, dest_styles)
 
         # Now move the old tag content and remove the tag.
         if dest_is_new:
@@ -782,7 +1308,7 @@ class SoupCleanupHelper(object):
             # destination is the child tag, "everything" includes the
             # destination.)
             self.move_contents_before(tag, tag)
-        tag.extract()
+        self.extract(tag)
 
         # It is possible that some styles that we copied from the font tag are
         # not needed. In order to not have to change more code: check
@@ -799,12 +1325,54 @@ class SoupCleanupHelper(object):
         """
         if contents_type == 'nonwhitespace_string':
             # Return non-whitespace NavigableStrings.
-            return tag.findAll(text=lambda x, r=self.rx_nbspace_only: r.match(x) == None, recursive=False)
+            return list(self.get_child_summary(tag)['strings'])
         elif contents_type == 'tags':
-            return tag.findAll(recursive=False)
+            return list(self.get_child_summary(tag)['tags'])
         # Default, though we probably won't call the function for this:
         return tag.contents
 
+    def get_child_summary(self, tag):
+        """Return a summary of the direct contents of a tag.
+
+        This is a dict with keys:
+        - 'tags': list of child tags;
+        - 'tags_by_name': dict of tag name -> list of child tags;
+        - 'strings': list of non-whitespace NavigableStrings (including e.g.
+          comments; like get_contents() always returned).
+        The summary is remembered in the tag until its contents get changed
+        through insert() / extract() / splice_contents(), so deciding what to
+        do with a tag based on its contents does not scan them every time.
+        Do not change the returned lists.
+        """
+        summary = tag.__dict__.get('_child_summary')
+        if summary is None:
+            tags = []
+            tags_by_name = {}
+            strings = []
+            for element in tag.contents:
+                if isinstance(element, Tag):
+                    tags.append(element)
+                    tags_by_name.setdefault(element.name, []).append(element)
+                elif (isinstance(element, NavigableString) and
+                      self.rx_nbspace_only.match(element) is None):
+                    strings.append(element)
+            summary = {'tags': tags,
+                       'tags_by_name': tags_by_name,
+                       'strings': strings}
+            tag.__dict__['_child_summary'] = summary
+        return summary
+
+    def replace_tag(self, tag, tag_name):
+        """Replace a tag by a new tag without attributes; return the new tag.
+
+        The contents of the old tag are moved into the new one.
+        """
+        new_tag = Tag(self.soup, tag_name)
+        self.insert_before(tag, new_tag)
+        self.move_contents_inside(tag, new_tag)
+        self.extract(tag)
+        return new_tag
+
     def move_contents_before(self, from_inside_tag, to_before_element):
         """Move all contents out of one tag, to just before another element."""
         self.move_contents_inside(from_inside_tag,
@@ -818,39 +1386,98 @@ class SoupCleanupHelper(object):
         Contents (all or last part) can be inserted at a specified index;
         default at the start).
         """
-        r = from_inside_tag.contents
-        i = insert_at_index
-        while len(r) > starting_from_index:
-            # We are assuming that Beautifulsoup itself starts out having
-            # maximum one consecutive NavigableString within a tag. It's easy
-            # to write code which inadvertantly assumes this is always the case.
-            # The below if/elif can be deleted, but they ease the adverse effect
-            # that such buggy code would have.
-            # Still, it's only a part solution / such code is considered buggy.
-            # Because every tag.extract() command could leave two consecutive
-            # NavigableStrings behind; there's nothing preventing that.
-            # Tip for tracing such buggy code: (un)comment all from the 'if' to
-            # 'else:' and re-run the script. The output should be the same.
-            #if i > 0 and r[fromindex].__class__.__name__ == 'NavigableString'
-            #and toinside.contents[i-1].__class__.__name__ == 'NavigableString':
-                # Append the string to be inserted, to the string appearing
-                # right before the destination. (Even though we always check
-                # this, this condition should only be true when inserting the
-                # first element.)
-            #    toinside.contents[i-1].replaceWith(str(toinside.contents[i-1])
-            #        + str(r[fromindex]))
-            #    r[fromindex].extract()
-            #elif len(r) == fromindex + 1 and i < len(toinside.contents) and
-            #    r[fromindex].__class__.__name__ == 'NavigableString' and
-            #    toinside.contents[i].__class__.__name__ == 'NavigableString':
-                # Prepend the last string to be inserted to the string
-                # appearing right after the destination (i.e. at the
-                # destinaton's index).
-            #    toinside.contents[i].replaceWith(str(r[fromindex]) + str(toinside.contents[i]))
-            #    r[fromindex].extract()
-            #else:
-            to_inside_tag.insert(i, r[starting_from_index])
-            i = i + 1
+        # We are assuming that Beautifulsoup itself starts out having maximum
+        # one consecutive NavigableString within a tag. It's easy to write code
+        # which inadvertantly assumes this is always the case. We could merge
+        # NavigableStrings at the edges of the moved contents with the strings
+        # next to them in the destination, to ease the adverse effect that
+        # such buggy code would have... but it's only a part solution / such
+        # code is considered buggy. Because every tag.extract() command could
+        # leave two consecutive NavigableStrings behind; there's nothing
+        # preventing that.
+        self.splice_contents(from_inside_tag, starting_from_index,
+                             len(from_inside_tag.contents), to_inside_tag,
+                             insert_at_index)
+
+    def splice_contents(self, from_inside_tag, start, end, to_inside_tag,
+                        index):
+        """Move a range of contents out of one tag, to inside another tag.
+
+        This moves from_inside_tag.contents[start:end] to to_inside_tag, at
+        the specified index, in one operation: unlike doing insert() for each
+        element, which shifts the rest of both contents lists (and relinks the
+        document) for every element, so that unwrapping a wide tag is
+        quadratic. Only the links at the edges of the range change; the moved
+        elements keep their links between each other.
+
+        The destination may be the same tag, but must not be inside the
+        range.
+        """
+        contents = from_inside_tag.contents
+        start = max(start, 0)
+        end = min(end, len(contents))
+        if start >= end:
+            return
+        elements = contents[start:end]
+        first = elements[0]
+        last = elements[-1]
+        last_descendant = last._lastRecursiveChild()
+
+        # Unlink the range from its old place.
+        before = first.previous
+        after = last_descendant.next
+        if before is not None:
+            before.next = after
+        if after is not None:
+            after.previous = before
+        if first.previousSibling is not None:
+            first.previousSibling.nextSibling = last.nextSibling
+        if last.nextSibling is not None:
+            last.nextSibling.previousSibling = first.previousSibling
+        del contents[start:end]
+        self._contents_changed(from_inside_tag, start - end)
+        self._invalidate_line_info(from_inside_tag, start)
+
+        # Link it into its new place. (This is what BeautifulSoup's insert()
+        # does for a single element.)
+        contents = to_inside_tag.contents
+        if from_inside_tag is to_inside_tag and index > start:
+            index = max(index - (end - start), start)
+        index = min(index, len(contents))
+        if index == 0:
+            first.previousSibling = None
+            first.previous = to_inside_tag
+        else:
+            first.previousSibling = contents[index - 1]
+            first.previousSibling.nextSibling = first
+            first.previous = contents[index - 1]._lastRecursiveChild()
+        first.previous.next = first
+        if index < len(contents):
+            last.nextSibling = contents[index]
+            last.nextSibling.previousSibling = last
+            last_descendant.next = contents[index]
+        else:
+            last.nextSibling = None
+            # The next element is the next sibling of the nearest ancestor
+            # which has one, if any.
+            parent = to_inside_tag
+            last_descendant.next = None
+            while parent is not None:
+                if parent.nextSibling is not None:
+                    last_descendant.next = parent.nextSibling
+                    break
+                parent = parent.parent
+        if last_descendant.next is not None:
+            last_descendant.next.previous = last_descendant
+        contents[index:index] = elements
+        self._contents_changed(to_inside_tag, len(elements))
+        delta = to_inside_tag.__dict__['_index_delta']
+        for i, element in enumerate(elements):
+            element.parent = to_inside_tag
+            element.__dict__['_index_hint'] = (to_inside_tag, index + i, delta)
+            self._index_new_tags(element)
+        self._invalidate_line_info(to_inside_tag, index)
+        self._invalidate_line_info(to_inside_tag, index + len(elements))
 
     def move_whitespace_to_parent(self, tag, remove_if_empty=True):
         """Move leading/trailing whitespace out of tag; remove empty tag.
@@ -871,135 +1498,110 @@ class SoupCleanupHelper(object):
         # Remove tags containing nothing.
         if not r:
             if remove_if_empty:
-                tag.extract()
+                self.extract(tag)
                 return
 
         # Move all-whitespace contents (including <br>) to before. This could
         # change r, so loop.
-        while self.regex_search(r[0], self.rx_spacehtml_only):
+        while self.is_whitespace(r[0], True):
             # Find destination tag, and possibly destination string, to move our
             # whitespace to.
-            t = tag
-            while (t.previousSibling is None and
-                   self.get_tag_name(t.parent) in self.inline_tag_names):
-                # Parent is inline and we'd be inserting whitespace at its
-                # start: continue to grandparent.
-                t = t.parent
-            dest_tag = t.parent
-            possible_dest = t.previousSibling
+            dest_tag, possible_dest = self.get_whitespace_destination(tag)
 
             # Move full-whitespace string/tag to its destination.
-            if (r[0].__class__.__name__ == 'Tag' or
-                    possible_dest.__class__.__name__ != 'NavigableString'):
+            if self.is_tag(r[0]) or not self.is_string(possible_dest):
                 # Move tag or full NavigableString into destination tag, either
                 # after the previous sibling or (if that does not exist) at the
                 # start. (The insert() command will implicitly remove it from
                 # its old location.)
-                dest_index = 0
                 if possible_dest:
-                    dest_index = self.get_index_in_parent(possible_dest) + 1
-                dest_tag.insert(dest_index, r[0])
+                    self.insert_after(possible_dest, r[0])
+                else:
+                    self.insert(dest_tag, 0, r[0])
             else:
                 # Prepend to existing string.
-                possible_dest.replaceWith(str(possible_dest) + str(r[0]))
+                self.replace_with(possible_dest, str(possible_dest) + str(r[0]))
                 # Remove existing NavigableString.
-                r[0].extract()
+                self.extract(r[0])
             if not r:
                 if remove_if_empty:
-                    tag.extract()
+                    self.extract(tag)
                     return
 
         # Move whitespace part at start of NavigableString to before tag.
-        m = self.regex_search(r[0], self.rx_nbspace_at_start)
+        m = self.search_string(r[0], self.rx_nbspace_at_start)
         if m:
             # Find destination tag/string to move our whitespace to.
-            t = tag
-            while (t.previousSibling is None and
-                   self.get_tag_name(t.parent) in self.inline_tag_names):
-                t = t.parent
-            dest_tag = t.parent
-            possible_dest = t.previousSibling
+            dest_tag, possible_dest = self.get_whitespace_destination(tag)
 
             # Move whitespace string to its destination.
-            if possible_dest.__class__.__name__ != 'NavigableString':
+            if not self.is_string(possible_dest):
                 # Insert new NavigableString into destination tag,either after
                 # the previous sibling or (if that does not exist) at the start.
                 element = NavigableString(m.group(1))
-                dest_index = 0
                 if possible_dest:
-                    dest_index = self.get_index_in_parent(possible_dest) + 1
-                dest_tag.insert(dest_index, element)
+                    self.insert_after(possible_dest, element)
+                else:
+                    self.insert(dest_tag, 0, element)
             else:
                 # Append to existing NavigableString.
-                possible_dest.replaceWith(str(possible_dest) + m.group(1))
+                self.replace_with(possible_dest,
+                                  str(possible_dest) + m.group(1))
 
             # Remove whitespace from the existing NavigableString.
             len_whitespace = len(m.group(1))
             s = str(r[0])
-            r[0].replaceWith(s[len_whitespace : ])
+            self.replace_with(r[0], s[len_whitespace : ])
 
         # Move all-whitespace contents (including <br>) to after. This could
         # change r, so loop. Because of above, we know r will never become
         # empty here.
-        while self.regex_search(r[-1], self.rx_spacehtml_only):
+        while self.is_whitespace(r[-1], True):
             # Find destination tag, and possibly destination string, to move our
             # whitespace to.
-            t = tag
-            while (t.nextSibling is None and
-                   self.get_tag_name(t.parent) in self.inline_tag_names):
-                # Parent is inline and we'd be inserting whitespace at its end:
-                # continue to grandparent.
-                t = t.parent
-            dest_tag = t.parent
-            possible_dest = t.nextSibling
+            dest_tag, possible_dest = self.get_whitespace_destination(tag, True)
 
             # Move full-whitespace string/tag to its destination.
-            if (r[-1].__class__.__name__ == 'Tag' or
-                    possible_dest.__class__.__name__ != 'NavigableString'):
+            if self.is_tag(r[-1]) or not self.is_string(possible_dest):
                 # Move tag or full NavigableString into destination tag, either
                 # before the next sibling or (if that does not exist) at the
                 # end. (The insert() command will implicitly remove it from its
                 # old location.)
                 if possible_dest:
-                    dest_index = self.get_index_in_parent(possible_dest)
+                    self.insert_before(possible_dest, r[-1])
                 else:
-                    dest_index = len(dest_tag.contents)
-                dest_tag.insert(dest_index, r[-1])
+                    self.insert(dest_tag, len(dest_tag.contents), r[-1])
             else:
                 # Prepend to existing string.
-                possible_dest.replaceWith(str(r[-1]) + str(possible_dest))
+                self.replace_with(possible_dest,
+                                  str(r[-1]) + str(possible_dest))
                 # Remove existing NavigableString.
-                r[-1].extract()
+                self.extract(r[-1])
 
         # Move whitespace part at end of NavigableString to after tag.
-        m = self.regex_search(r[-1], self.rx_nbspace_at_end)
+        m = self.search_string(r[-1], self.rx_nbspace_at_end)
         if m:
             # Find destination tag/string to move our whitespace to.
-            t = tag
-            while (t.nextSibling is None and
-                   self.get_tag_name(t.parent) in self.inline_tag_names):
-                t = t.parent
-            dest_tag = t.parent
-            possible_dest = t.nextSibling
+            dest_tag, possible_dest = self.get_whitespace_destination(tag, True)
 
             # Move whitespace string to its destination.
-            if possible_dest.__class__.__name__ != 'NavigableString':
+            if not self.is_string(possible_dest):
                 # Insert new NavigableString into destination tag, either before
                 # the next sibling or (if that does not exist) at the end.
                 element = NavigableString(m.group(1))
                 if possible_dest:
-                    dest_index = self.get_index_in_parent(possible_dest)
+                    self.insert_before(possible_dest, element)
                 else:
-                    dest_index = len(dest_tag.contents)
-                dest_tag.insert(dest_index, element)
+                    self.insert(dest_tag, len(dest_tag.contents), element)
             else:
                 # Prepend to existing NavigableString.
-                possible_dest.replaceWith(m.group(1) + str(possible_dest))
+                self.replace_with(possible_dest,
+                                  m.group(1) + str(possible_dest))
 
             # Remove whitespace from the existing NavigableString.
             len_whitespace = len(m.group(1))
             s = str(r[-1])
-            r[-1].replaceWith(s[ : -len_whitespace])
+            self.replace_with(r[-1], s[ : -len_whitespace])
 
     def starts_rendered_line(self, element):
         """Determine if an element is on the beginning of a rendered line.
@@ -1008,29 +1610,72 @@ class SoupCleanupHelper(object):
         contents and all non-inline elements take up the full vertical space for
         themselves (i.e. they start at a new line, and the content directly
         after them does too).
+
+        If the element is the first child of an inline tag, the answer is the
+        one for that tag; it gets remembered there, so we do not climb the same
+        chain of ancestors for every string in deeply nested inline markup.
+        insert() / extract() forget the remembered answers which their change
+        could affect. (So if you change the document through BeautifulSoup
+        methods, or change inline_tag_names, while also calling this method,
+        results can be wrong.)
         """
         # If a previous element exists within the same parent, assume we're at
         # the start of a line if the element is non-inline, and we're not at the
         # start if the element is inline. (See assumption in docstring.)
         previous = element.previousSibling
-        while previous is None:
-            # If we're at the start of an inline tag, keep looking outside that
-            # tag. If we're at the start of another tag, assume we're at the
-            # start of a line.
-            if not self.get_tag_name(element.parent) in self.inline_tag_names:
-                at_line_start = True
-                break
-            # We also assume we will never get here with the very first element
-            # in the document (because there's always a <head> which breaks this
-            # loop).
-            element = element.parent
-            previous = element.previousSibling
-
-        if previous != None:
-            n = self.get_tag_name(previous)
-            at_line_start = not(n == '' or n in self.inline_tag_names)
+        if previous is not None:
+            return self.is_tag(previous) and not self.is_inline(previous)
+
+        # If we're at the start of an inline tag, the answer is the one for
+        # that tag. If we're at the start of another tag, assume we're at the
+        # start of a line. (We also assume we will never get here with the very
+        # first element in the document, because there's always a <head>.)
+        parent = element.parent
+        if not self.is_inline(parent):
+            return True
+        at_line_start = parent.__dict__.get('_line_start')
+        if at_line_start is None:
+            at_line_start = self.starts_rendered_line(parent)
+            parent.__dict__['_line_start'] = at_line_start
         return at_line_start
 
+    def get_whitespace_destination(self, element, after=False):
+        """Find where to move whitespace at the start/end of an element.
+
+        Returns the tag to move whitespace into, and the sibling (or None)
+        which the whitespace should be put after (or, if after=True, before).
+        That is: the parent/previous sibling of the element... except if the
+        element is at the start (end) of an inline tag, in which case we use
+        the parent/sibling of that tag, and so on.
+
+        Like starts_rendered_line(), this remembers the result for the inline
+        tags it climbs through.
+        """
+        anchor = self._get_whitespace_anchor(element, after)
+        if after:
+            return anchor.parent, anchor.nextSibling
+        return anchor.parent, anchor.previousSibling
+
+    def _get_whitespace_anchor(self, element, after):
+        """Return the outermost inline tag that element is at the start/end of.
+
+        (Or the element itself, if it isn't at the start/end of an inline tag.)
+        Helper for get_whitespace_destination().
+        """
+        sibling = element.nextSibling if after else element.previousSibling
+        parent = element.parent
+        if sibling is not None or not self.is_inline(parent):
+            return element
+        if after:
+            key = '_whitespace_anchor_after'
+        else:
+            key = '_whitespace_anchor_before'
+        anchor = parent.__dict__.get(key)
+        if anchor is None:
+            anchor = self._get_whitespace_anchor(parent, after)
+            parent.__dict__[key] = anchor
+        return anchor
+
     def dedupe_whitespace(self, navstr):
         """De-duplicate whitespace in NavigableString.
 
@@ -1040,15 +1685,56 @@ class SoupCleanupHelper(object):
         whitespace & the keeping of a newline as the deduped string.
         """
         at_line_start = self.starts_rendered_line(navstr)
-        result = str(navstr)
+        orig_value = str(navstr)
         # Merge consecutive strings.
+        values = [orig_value]
         nexttag = navstr.nextSibling
         while (nexttag != None
-               and nexttag.__class__.__name__ == 'NavigableString'):
-            result += str(nexttag)
-            nexttag.extract()
+               and self.is_string(nexttag)):
+            values.append(str(nexttag))
+            self.extract(nexttag)
             nexttag = navstr.nextSibling
 
+        result = self.dedupe_whitespace_string(''.join(values), at_line_start)
+        if result != orig_value:
+            self.replace_with(navstr, result)
+
+    def dedupe_all_whitespace(self, tag_names, root=None):
+        """De-duplicate whitespace in all strings directly inside given tags.
+
+        This calls dedupe_whitespace() for all NavigableStrings whose parent is
+        a tag with one of the given names, in one traversal of the document
+        (or the contents of root). Strings directly inside other tags are left
+        alone, even if those are inside one of the given tags; there are tags
+        like <pre> where we don't want to touch the whitespace.
+        """
+        if root is None:
+            root = self.soup
+        tag_names = set(tag_names)
+        tags = [root]
+        while tags:
+            tag = tags.pop()
+            dedupe = tag.__class__ is Tag and tag.name in tag_names
+            child_tags = []
+            r = tag.contents
+            i = 0
+            while i < len(r):
+                if r[i].__class__ is Tag:
+                    child_tags.append(r[i])
+                elif dedupe and self.is_string(r[i]):
+                    # This may shorten r, but does not extract r[i].
+                    self.dedupe_whitespace(r[i])
+                i += 1
+            child_tags.reverse()
+            tags.extend(child_tags)
+
+    def dedupe_whitespace_string(self, value, at_line_start):
+        """De-duplicate whitespace in a string; return the new string.
+
+        This contains the logic for dedupe_whitespace(); at_line_start says
+        whether the string always gets rendered at the start of a line. The
+        string is scanned from start to end only once.
+        """
         # Dedupe spaces at start of our string.
         # - Replace single &nbsp;s too, unless our constant says not to OR our
         #   string is at the start of a rendered line.
@@ -1057,14 +1743,12 @@ class SoupCleanupHelper(object):
         rx = self.rx_multispace_at_start
         if self.dedupe_nbsp and not at_line_start:
             rx = self.rx_multinbspace_at_start
-        m = rx.search(result)
+        m = rx.match(value)
         if m:
             replacement = ' '
             if at_line_start and m.group(1).find('\n') != -1:
                 replacement = '\n'
-            # This sub() does not need restrictions because we know it replaces
-            # maximum one occurrence.
-            result = rx.sub(replacement, result)
+            value = replacement + value[m.end() : ]
 
         # Dedupe spaces elsewhere in our string. Since we won't touch the very
         # start of our string anymore, the replacement is never '\n'.
@@ -1072,22 +1756,14 @@ class SoupCleanupHelper(object):
             # We want to deduplicate &nbsp;s too, but not those wich occur in
             # whitespace at the very start of our string. (We just explicitly
             # prevented replacing those, above.) We have a special regex for
-            # this. We should be able to just replace all occurrences with one
-            # command (like in the 'else' below) but \1 does not seem to work
-            # as replacement? So loop and replace one by one.
-            m = self.regex_search(result, self.rx_multinbspace_not_at_start)
-            while m:
-                result = self.rx_multinbspace_not_at_start.sub(
-                    m.group(1) + ' ', result, 1)
-                m = self.regex_search(result, self.rx_multinbspace_not_at_start)
-        else:
-            # Deduplicate single &nbsp;s too, unless our constant says not to OR
-            # we've already just done it.
-            rx = self.rx_multinbspace if self.dedupe_nbsp else self.rx_multispace
-            result = rx.sub(' ', result)
-
-        if result != str(navstr):
-            navstr.replaceWith(result)
+            # this, which also matches the character before the whitespace, so
+            # we need to put that back.
+            return self.rx_multinbspace_not_at_start.sub(
+                lambda m: m.group(1) + ' ', value)
+        # Deduplicate single &nbsp;s too, unless our constant says not to OR
+        # we've already just done it.
+        rx = self.rx_multinbspace if self.dedupe_nbsp else self.rx_multispace
+        return rx.sub(' ', value)
 
     def strip_leading_whitespace(self, navstr, including_newline=None):
         """Strip whitespace from the start of a NavigableString.
@@ -1108,7 +1784,7 @@ class SoupCleanupHelper(object):
         """
         force_strip_newline = including_newline is True
         readd_newline = including_newline is False
-        match = self.regex_search(navstr, self.rx_spaces_at_start)
+        match = self.search_string(navstr, self.rx_spaces_at_start)
         while match:
             replacement = ''
             if not force_strip_newline and navstr.find('\n') != -1:
@@ -1119,14 +1795,14 @@ class SoupCleanupHelper(object):
                 #  We need to loop back and check again. Also, if we encountered
                 # a newline then add at most one back at the start.
                 nxt = navstr.nextSibling
-                navstr.extract()
+                self.extract(navstr)
                 navstr = nxt
                 if replacement:
                     readd_newline = True
                 match = None
                 if (navstr != None and
-               	        navstr.__class__.__name__ == 'NavigableString'):
-                    match = self.regex_search(navstr, self.rx_spaces_at_start)
+               	        self.is_string(navstr)):
+                    match = self.search_string(navstr, self.rx_spaces_at_start)
             elif replacement != match.group(1):
                 # String is only part whitespace: strip/replace it and be done.
                 # Handle the adding-of-newlines here.
@@ -1136,7 +1812,8 @@ class SoupCleanupHelper(object):
                 if replacement:
                     readd_newline = False
                 s = str(navstr)
-                navstr.replaceWith(replacement + s[ len(match.group(1)) : ])
+                self.replace_with(navstr,
+                                  replacement + s[ len(match.group(1)) : ])
                 match = None
             else:
                 # replacement == '\n' and navstr starts with a single newline
@@ -1149,12 +1826,12 @@ class SoupCleanupHelper(object):
             # As noted: re-add newline.
             if navstr is None:
                 element = NavigableString('\n')
-                navstr.parent.insert(0, element)
-            elif navstr.__class__.__name__ == 'Tag':
+                self.insert(navstr.parent, 0, element)
+            elif self.is_tag(navstr):
                 element = NavigableString('\n')
-                navstr.parent.insert(self.get_index_in_parent(navstr), element)
+                self.insert_before(navstr, element)
             else:
-                navstr.replaceWith('\n' + str(navstr))
+                self.replace_with(navstr, '\n' + str(navstr))
 
     def strip_trailing_whitespace(self, navstr, including_newline=None):
         """Strip whitespace from the end of a NavigableString.
@@ -1171,7 +1848,7 @@ class SoupCleanupHelper(object):
         """
         force_strip_newline = including_newline is True
         readd_newline = including_newline is False
-        match = self.regex_search(navstr, self.rx_nbspace_at_end)
+        match = self.search_string(navstr, self.rx_nbspace_at_end)
         while match:
             replacement = ''
             if not force_strip_newline and navstr.find('\n') != -1:
@@ -1182,14 +1859,14 @@ class SoupCleanupHelper(object):
                 # We need to loop back and check again. Also, if we encountered
                 # a newline then add at most one back at the end.
                 prev = navstr.previousSibling
-                navstr.extract()
+                self.extract(navstr)
                 navstr = prev
                 if replacement:
                     readd_newline = True
                 match = None
                 if (navstr != None and
-                        navstr.__class__.__name__ == 'NavigableString'):
-                    match = self.regex_search(navstr, self.rx_nbspace_at_end)
+                        self.is_string(navstr)):
+                    match = self.search_string(navstr, self.rx_nbspace_at_end)
             elif replacement != match.group(1):
                 # String is only part whitespace: strip/replace it and be done.
                 # Handle the adding-of-newlines here.
@@ -1199,7 +1876,8 @@ class SoupCleanupHelper(object):
                 if replacement:
                     readd_newline = False
                 s = str(navstr)
-                navstr.replaceWith(s[ : -len(match.group(1))] + replacement)
+                self.replace_with(navstr,
+                                  s[ : -len(match.group(1))] + replacement)
                 match = None
             else:
                 # replacement == '\n' and navstr ends with a non-space followed
@@ -1211,13 +1889,13 @@ class SoupCleanupHelper(object):
         if readd_newline and including_newline != True and navstr != None:
             # As noted: re-add newline unless NavigableString ends in newline.
             # (And unless tag contents are now empty.)
-            if navstr.__class__.__name__ == 'Tag':
+            if self.is_tag(navstr):
                 elm = NavigableString('\n')
-                navstr.parent.insert(self.get_index_in_parent(navstr) + 1, elm)
+                self.insert_after(navstr, elm)
             else:
                 s = str(navstr)
                 if s[-1] != '\n':
-                    navstr.replaceWith(s + '\n')
+                    self.replace_with(navstr, s + '\n')
 
     def strip_non_inline_whitespace(self, tag, including_newline=None):
         """Remove whitespace from start / end of a tag's contents.
@@ -1247,20 +1925,18 @@ class SoupCleanupHelper(object):
             #   the rendered document, so we should remove it.
             # - Any &nbsp;: same.
             readd_newline = False
-            if (r[-1].__class__.__name__ == 'Tag' and
-                    self.get_tag_name(r[-1]) == 'br'):
-                r[-1].extract()
-            elif (self.regex_search(r[-1], self.rx_nbspace_only) and
+            if self.get_tag_name(r[-1]) == 'br':
+                self.extract(r[-1])
+            elif (self.is_whitespace(r[-1]) and
                   len(r) > 1 and
-                  r[-2].__class__.__name__ == 'Tag' and
                   self.get_tag_name(r[-2]) == 'br'):
                 # Remove both the spaces and this one <br>, then check the next.
                 # If there was a newline somewhere after the <br> then add that
                 # after the last remaining tag/string - except if the string
                 # already ends in a newline.
                 readd_newline = r[-1].find('\n') != -1
-                r[-1].extract()
-                r[-1].extract()
+                self.extract(r[-1])
+                self.extract(r[-1])
             # Now strip (more) spaces from the end of the last
             # NavigableString(s), but no (more) <br>. (If the tag is now
             # totally empty, don't readd newline.)
@@ -1282,112 +1958,249 @@ class SoupCleanupHelper(object):
         - mangle_tag() (which does effectively the same by removing child tag)
         - dedupe_whitespace() (because this method is lazy and assumes the only
           possible whitespace between <br>s is a single newline).
+
+        All double <br>s inside one paragraph are found first, after which the
+        paragraph is split into several paragraphs in one go (from the end,
+        so every element is moved only once). So paragraphs with hundreds of
+        line breaks, like poems or addresses, don't take quadratic time.
         """
-        for br in self.soup.findAll('br'):
-            found = False
+        # Find paragraphs which contain <br>s directly.
+        paragraphs = []
+        seen = set()
+        for br in self.find_tags('br'):
+            parent_tag = br.parent
+            if (self.get_tag_name(parent_tag) == 'p' and
+                    id(parent_tag) not in seen):
+                seen.add(id(parent_tag))
+                paragraphs.append(parent_tag)
+
+        for parent_tag in paragraphs:
+            contents = parent_tag.contents
+            for br_index, next_index in reversed(
+                    self._find_double_br(parent_tag)):
+                # Insert a newline and a new paragraph just after our
+                # paragraph. (We always insert one newline, regardless whether
+                # the <br>s are followed by newlines.)
+                p2 = Tag(self.soup, 'p')
+                self.insert_after(parent_tag, p2)
+                e = NavigableString('\n')
+                self.insert_after(parent_tag, e)
+                # Move all content after the second <br> into the new
+                # paragraph.
+                self.splice_contents(parent_tag, next_index, len(contents),
+                                     p2, 0)
+                # Remove the <br>s and the newline between them (if any),
+                # which are now at the end.
+                while len(contents) > br_index:
+                    self.extract(contents[-1])
+
+    def _find_double_br(self, parent_tag):
+        """Find double <br>s to split a paragraph at.
+
+        Helper for split_paragraphs_with_double_br(). Returns a list of (index
+        of first <br>, index after second <br>) for all double <br>s in the
+        paragraph which have a tag (that isn't a <br>) just before and a tag
+        just after them, optionally separated by a newline.
+        """
+        contents = parent_tag.contents
+        length = len(contents)
+        found = []
+        for i, element in enumerate(contents):
+            if self.get_tag_name(element) != 'br':
+                continue
             # Check if previous is not a <br>...
-            lf = None
-            e = br.previousSibling
-            if (e != None and e.__class__.__name__ == 'NavigableString' and
-                    str(e) == '\n'):
-                e = e.previousSibling
-            if (e != None and e.__class__.__name__ == 'Tag' and
-                    self.get_tag_name(e) != 'br'):
-                # ...and the next is a <br>...
-                br2 = br.nextSibling
-                if (br2 != None and br2.__class__.__name__ == 'NavigableString'
-                        and str(br2) == '\n'):
-                    lf = br2
-                    br2 = br2.nextSibling
-                if (br2 != None and br2.__class__.__name__ == 'Tag' and
-                        self.get_tag_name(br2) == 'br'):
-                    # ...and the one after that is not a <br>...
-                    next_element = br2.nextSibling
-                    if (next_element != None
-                        and next_element.__class__.__name__ == 'NavigableString'
-                        and str(next_element) == '\n'):
-                        next_element = next_element.nextSibling
-                    if (next_element != None
-                            and next_element.__class__.__name__ == 'Tag'
-                            and self.get_tag_name(e) != 'br'):
-                        # ...and the parent is a <p>: (Note we only replace if
-                        # <p> is a direct parent. A double <br> inside an
-                        # inline tag like <em> is semantically almost the same,
-                        # but it's too much work to then also close and reopen
-                        # the inline tags.)
-                        parent_tag = br.parent
-                        if self.get_tag_name(parent_tag) == 'p':
-                            # Too much indenting here. Do an 'if found'.
-                            found = True
-            if found:
-                # We have exactly two <br>s, inside a <p>. Move contents after
-                # t2 to a new paragraph.
-                if next_element is None:
-                    # The two br's were at the end of a paragraph. Strange. Move
-                    # them outside (just after) the paragraph.
-                    parent_tag.parent.insert(
-                        self.get_index_in_parent(parent_tag) + 1, br2)
-                    if lf != None:
-                        parent_tag.parent.insert(
-                            self.get_index_in_parent(parent_tag) + 1, lf)
-                    parent_tag.parent.insert(
-                        self.get_index_in_parent(parent_tag) + 1, br)
-                else:
-                    # Insert a newline and a new paragraph just
-                    # after our paragraph. (We always insert one
-                    # newline, regardless whether the <br>s are
-                    # followed by newlines.)
-                    i = self.get_index_in_parent(parent_tag) + 1
-                    p2 = Tag(self.soup, 'p')
-                    parent_tag.parent.insert(i, p2)
-                    e = NavigableString('\n')
-                    parent_tag.parent.insert(i, e)
-                    # Move all content after the second <br> into
-                    # the new paragraph, after removing a newline
-                    # if that follows the second <br>.
-                    if (next_element != None and
-                            next_element.__class__.__name__ == 'NavigableString'
-                            and str(next_element) == '\n'):
-                        next_element.extract()
-                    self.move_contents_inside(parent_tag, p2, 0,
-                                              self.get_index_in_parent(br2) + 1)
-                    # Remove the <br>s and the newline between them (if any).
-                    br2.extract()
-                    br.extract()
-                    if lf != None:
-                        lf.extract()
+            j = i - 1
+            if j >= 0 and self.is_string(contents[j]) and contents[j] == '\n':
+                j -= 1
+            if (j < 0 or not self.is_tag(contents[j]) or
+                    self.get_tag_name(contents[j]) == 'br'):
+                continue
+            # ...and the next is a <br>...
+            j = i + 1
+            if (j < length and self.is_string(contents[j]) and
+                    contents[j] == '\n'):
+                j += 1
+            if j >= length or self.get_tag_name(contents[j]) != 'br':
+                continue
+            next_index = j + 1
+            # ...and the one after that is a tag. (This can also be a <br>.)
+            j = next_index
+            if (j < length and self.is_string(contents[j]) and
+                    contents[j] == '\n'):
+                j += 1
+            if j < length and self.is_tag(contents[j]):
+                found.append((i, next_index))
+        return found
+
+    def check_tables(self, li_img_re):
+        """Remove single-cell tables and convert 'bullet tables' to lists.
+
+        This does the same as calling remove_single_cell_table() for all
+        tables in the document and then check_convert_table_to_list() for all
+        remaining tables, except it looks at the structure of every table only
+        once. Tables are processed in document order; nested tables which were
+        removed together with their parent table are skipped.
+
+        The bullet check of a table can depend on tables nested directly inside
+        it, its rows or their first cells: if those are removed, the table can
+        turn out to be a bullet table. So before checking a table for bullets,
+        we do the single-cell check for those nested tables, like the separate
+        loops did.
+        """
+        # Tables for which the single-cell check was done, and which are kept.
+        checked = set()
+        for table in self.find_tags('table'):
+            if self._get_document_position(table, {id(self.soup): ()}) is None:
+                continue
+            if id(table) not in checked:
+                analysis = self.analyze_table(table)
+                if analysis['action']:
+                    self._apply_table_analysis(table, analysis)
+                    continue
+            if li_img_re is None:
+                continue
+            for nested in self._get_bullet_check_tables(table):
+                if id(nested) not in checked:
+                    analysis = self.analyze_table(nested)
+                    if analysis['action']:
+                        self._apply_table_analysis(nested, analysis)
+                    else:
+                        checked.add(id(nested))
+            analysis = self.analyze_table(table, False, li_img_re)
+            self._apply_table_analysis(table, analysis)
+
+    def _get_bullet_check_tables(self, table):
+        """Return the tables which can influence the bullet check of a table.
+
+        These are the tables directly inside the table, its rows, or the first
+        cell of its rows.
+        """
+        tables = []
+        summary = self.get_child_summary(table)
+        tables.extend(summary['tags_by_name'].get('table', []))
+        for tr in summary['tags_by_name'].get('tr', []):
+            row_summary = self.get_child_summary(tr)
+            tables.extend(row_summary['tags_by_name'].get('table', []))
+            cells = row_summary['tags_by_name'].get('td')
+            if cells:
+                cell_summary = self.get_child_summary(cells[0])
+                tables.extend(cell_summary['tags_by_name'].get('table', []))
+        return tables
+
+    def analyze_table(self, table, check_single_cell=True, li_img_re=None):
+        """Determine the structure of a table and what to do with it.
+
+        Returns a dict with:
+        - 'rows': list of the direct <tr> children of the table;
+        - 'cells': list with, for every row that was inspected, the list of
+          its direct <td> children;
+        - 'action': None or one of
+          - 'remove': (only if check_single_cell is True) the table has no
+            contents, or one row with no contents/cells;
+          - 'unwrap': (same) the table has one row with one cell, which is
+            useless; take the cell's contents out of the table;
+          - 'list': (only if li_img_re is given) every row has two cells, the
+            first of which only contains an image whose 'src' matches
+            li_img_re; make a <ul> with the contents of the second cells.
+        The single-cell checks are done first; the table is only checked for
+        bullets if it has not been decided to remove/unwrap it. The bullet
+        check raises an exception if the table contains other things than
+        rows, or a row that is being checked contains other things than cells.
+        """
+        summary = self.get_child_summary(table)
+        rows = summary['tags_by_name'].get('tr', [])
+        analysis = {'rows': rows, 'cells': [], 'action': None}
+
+        if check_single_cell:
+            if not summary['strings'] and not summary['tags']:
+                analysis['action'] = 'remove'
+                return analysis
+            if len(rows) == 1:
+                row_summary = self.get_child_summary(rows[0])
+                cells = row_summary['tags_by_name'].get('td', [])
+                analysis['cells'].append(cells)
+                if ((not row_summary['strings'] and not row_summary['tags'])
+                        or not cells):
+                    analysis['action'] = 'remove'
+                    return analysis
+                if len(cells) == 1:
+                    analysis['action'] = 'unwrap'
+                    return analysis
+
+        if li_img_re is not None:
+            if len(summary['strings']) + len(summary['tags']) != len(rows):
+                raise Exception('Parse error: table contains other direct tags '
+                                'than tr.')
+            analysis['cells'] = []
+            for tr in rows:
+                row_summary = self.get_child_summary(tr)
+                cells = row_summary['tags_by_name'].get('td', [])
+                if (len(row_summary['strings']) + len(row_summary['tags']) !=
+                        len(cells)):
+                    raise Exception('Parse error: tr contains other direct '
+                                    'tags than td.')
+                analysis['cells'].append(cells)
+                # The first 'td' must contain a sigle 'img' tag. Skip checking
+                # further rows if any row does not have a bullet.
+                if len(cells) != 2:
+                    break
+                cell_summary = self.get_child_summary(cells[0])
+                images = cell_summary['tags']
+                if not (not cell_summary['strings'] and len(images) == 1 and
+                        self.get_tag_name(images[0]) == 'img' and
+                        li_img_re.search(images[0]['src'])):
+                    break
+            else:
+                analysis['action'] = 'list'
+
+        return analysis
+
+    def _apply_table_analysis(self, table, analysis):
+        """Change a table according to the result of analyze_table()."""
+        action = analysis['action']
+        if action == 'remove':
+            self.extract(table)
+
+        elif action == 'unwrap':
+            # Content inside a 'td' is left aligned by default; accomodate for
+            # that. (check_alignment() can delete it later if needed.)
+            e = Tag(self.soup, 'div')
+            e['style'] = 'text-align: left'
+            self.insert_before(table, e)
+            self.move_contents_inside(analysis['cells'][0][0], e)
+            self.extract(table)
+
+        elif action == 'list':
+            # This table contains only bullets. Insert ul just before the
+            # table.
+            ul = Tag(self.soup, 'ul')
+            # Content inside a 'td' is left aligned by default.
+            ul['style'] = 'text-align: left'
+            self.insert_before(table, ul)
+            # Pad the inside of the ul (at start and end) with \n.
+            element = NavigableString('\n')
+            self.insert(ul, 0, element)
+            # Insert li's and move all the contents from the second td's into
+            # there. Other code will take care of straightening out e.g.
+            # spacing. (Is it always legal to just 'dump everything' inside a
+            # li? Let's hope so.)
+            i = 1
+            for cells in analysis['cells']:
+                e = Tag(self.soup, 'li')
+                self.insert(ul, i, e)
+                self.move_contents_inside(cells[1], e)
+                e = NavigableString('\n')
+                self.insert(ul, i + 1, e)
+                i = i + 2
+            self.extract(table)
 
     def remove_single_cell_table(self, table):
         """Delete tables with one <tr> having one <td>; these are useless.
 
-        (Take their contents out of the tables.)
+        (Take their contents out of the tables.) Also delete tables without
+        contents, or with one <tr> without contents/cells.
         """
-        r1 = self.get_contents(table, 'nonwhitespace_string')
-        r2 = self.get_contents(table, 'tags')
-        if len(r1) + len(r2) == 0:
-            table.extract()
-        else:
-            r_tr = table.findAll('tr', recursive=False)
-            if len(r_tr) == 1:
-
-                r1 = self.get_contents(r_tr[0], 'nonwhitespace_string')
-                r2 = self.get_contents(r_tr[0], 'tags')
-                if len(r1) + len(r2) == 0:
-                    table.extract()
-                else:
-                    r_td = r_tr[0].findAll('td', recursive=False)
-                    if not r_td:
-                        table.extract()
-                    elif len(r_td) == 1:
-
-                        # Content inside a 'td' is left aligned by default;
-                        # accomodate for that. (check_alignment() can delete it
-                        # later if needed.)
-                        e = Tag(self.soup, 'div')
-                        e['style'] = 'text-align: left'
-                        table.parent.insert(self.get_index_in_parent(table), e)
-                        self.move_contents_inside(r_td[0], e)
-                        table.extract()
+        self._apply_table_analysis(table, self.analyze_table(table))
 
     def check_convert_table_to_list(self, table, li_img_re):
         """Convert table with a specific layout to ul/li's.
@@ -1403,58 +2216,5 @@ class SoupCleanupHelper(object):
         bullet_img_re is a compiled regular expression which must match the
         'src' of the images in the first column, for replacement to happen.
         """
-        r1 = self.get_contents(table, 'nonwhitespace_string')
-        r2 = self.get_contents(table, 'tags')
-        r_tr = table.findAll('tr', recursive=False)
-        if len(r1) + len(r2) != len(r_tr):
-            raise Exception('Parse error: table contains other direct tags '
-                            'than tr.')
-
-        all_bullets = 1
-        for tr in r_tr:
-            # 'Break' (skip further processing) if any row does not have all
-            # bullets.
-            if all_bullets:
-                all_bullets = 0
-
-                r1 = self.get_contents(tr, 'nonwhitespace_string')
-                r2 = self.get_contents(tr, 'tags')
-                r_td = tr.findAll('td', recursive=False)
-                if len(r1) + len(r2) != len(r_td):
-                    raise Exception('Parse error: tr contains other direct '
-                                    'tags than td.')
-
-                if len(r_td) == 2:
-                    # The first 'td' must contain a sigle 'img' tag.
-                    r1 = self.get_contents(r_td[0], 'nonwhitespace_string')
-                    r2 = self.get_contents(r_td[0], 'tags')
-                    if (not r1 and len(r2) == 1 and
-                            self.get_tag_name(r2[0]) == 'img' and
-                            li_img_re.search(r2[0]['src'])):
-                        all_bullets = 1
-
-        if all_bullets:
-            # Looped through all rows; we know if this table contains only
-            # bullets. Insert ul just before the table.
-            ul = Tag(self.soup, 'ul')
-            # Content inside a 'td' is left aligned by default.
-            ul['style'] = 'text-align: left'
-            i = self.get_index_in_parent(table)
-            table.parent.insert(i, ul)
-            # Pad the inside of the ul (at start and end) with \n.
-            element = NavigableString('\n')
-            ul.insert(0, element)
-            # Insert li's and move all the contents from the second td's into
-            # there. Other code will take care of straightening out e.g.
-            # spacing. (Is it always legal to just 'dump everything' inside a
-            # li? Let's hope so.)
-            i = 1
-            for tr in r_tr:
-                e = Tag(self.soup, 'li')
-                ul.insert(i, e)
-                r_td = tr.findAll('td', recursive=False)
-                self.move_contents_inside(r_td[1], e)
-                e = NavigableString('\n')
-                ul.insert(i + 1, e)
-                i = i + 2
-            table.extract()
+        self._apply_table_analysis(table,
+                                   self.analyze_table(table, False, li_img_re))
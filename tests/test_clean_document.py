@@ -0,0 +1,84 @@
+"""Tests for cleaning several documents in one process with clean_document().
+
+Run from the repository root: python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cleanup_msfp import DocumentCleaner, clean_document
+from soupcleanup import SoupCleanupHelper
+
+
+class CleanDocumentTest(unittest.TestCase):
+
+    def setUp(self):
+        # Values cached while cleaning one document are used for the next one;
+        # start every test with an empty cache.
+        SoupCleanupHelper.normalized_values.clear()
+
+    def test_cached_style_value_with_non_ascii_document(self):
+        # The first document leaves a (unicode) normalized style value in the
+        # cache; the second has the same value before parsing (as a byte
+        # string) in a document with non-ASCII text.
+        first = '<html><body><p><font color="black" size="2">x</font></p>' \
+            '</body></html>'
+        second = '<html><body><p style="color: black; font-size: 2">' \
+            '\xc3\xa9 y</p></body></html>'
+        expected = clean_document(second)
+        SoupCleanupHelper.normalized_values.clear()
+
+        self.assertEqual(clean_document(first),
+                         '<html><body><p style="font-size: 2">x</p>'
+                         '</body></html>')
+        output = clean_document(second)
+        self.assertEqual(output, expected)
+        self.assertTrue(isinstance(output, str))
+
+    def test_rule_changed_after_construction(self):
+        cleaner = DocumentCleaner()
+        html = '<html><body><p lang="en">x</p></body></html>'
+        self.assertEqual(cleaner.clean(html),
+                         '<html><body><p>x</p></body></html>')
+        fingerprint = cleaner.get_fingerprint()
+
+        del cleaner.soup_helper.remove_attributes['*']['lang']
+        self.assertEqual(cleaner.clean(html), html)
+        self.assertNotEqual(cleaner.get_fingerprint(), fingerprint)
+        # Also if the first document is cleaned after changing the rule.
+        cleaner = DocumentCleaner()
+        del cleaner.soup_helper.remove_attributes['*']['lang']
+        self.assertEqual(cleaner.clean(html), html)
+
+    def test_scripts_not_pruned_before_parsing(self):
+        html = '<html><body><script>a</script><p>x</p><!-- c --></body></html>'
+        self.assertEqual(clean_document(html, {'prune_tags': []}),
+                         '<html><body><p>x</p></body></html>')
+        # An unclosed script is not pruned; the parser makes it swallow the
+        # rest of the document.
+        html = '<html><body><p>x</p><script>var a=1;\n<p>y</p>\n</body></html>'
+        self.assertEqual(clean_document(html),
+                         '<html><body><p>x</p></body></html>')
+
+    def test_duplicate_style_properties(self):
+        # The last color counts (and is removed); the overridden one must not
+        # be kept.
+        html = '<html><body><p style="color: #FF0000; text-align: left; ' \
+            'color: black">x</p></body></html>'
+        self.assertEqual(clean_document(html),
+                         '<html><body><p>x</p></body></html>')
+
+    def test_namespace_declarations_only_removed_from_tags(self):
+        html = '<html xmlns:o="urn:x" lang="en"><body>' \
+            '<p>Use xmlns:o="urn:x" in your file</p></body></html>'
+        self.assertEqual(clean_document(html),
+                         '<html lang="en"><body>'
+                         '<p>Use xmlns:o="urn:x" in your file</p>'
+                         '</body></html>')
+
+
+if __name__ == '__main__':
+    unittest.main()
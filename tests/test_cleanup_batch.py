@@ -0,0 +1,70 @@
+"""Tests for get_file_pairs() and clean_files() in cleanup_batch.py.
+
+Run from the repository root: python -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cleanup_batch import clean_files, get_file_pairs
+from soupcleanup import SoupCleanupHelper
+
+
+class CleanupBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.directory, 'output')
+        SoupCleanupHelper.normalized_values.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_file(self, relative_path, html):
+        """Write an input file; return its path."""
+        path = os.path.join(self.directory, relative_path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as file_handle:
+            file_handle.write(html)
+        return path
+
+    def test_same_output_file(self):
+        html = '<html><body><p>x</p></body></html>'
+        a = self.write_file(os.path.join('a', 'index.htm'), html)
+        b = self.write_file(os.path.join('b', 'index.htm'), html)
+        self.assertRaises(Exception, get_file_pairs, [a, b], self.output_dir)
+
+    def test_same_input_file_twice(self):
+        path = self.write_file(os.path.join('a', 'index.htm'),
+                               '<html><body><p>x</p></body></html>')
+        same_path = os.path.join(self.directory, 'a', '.', 'index.htm')
+        file_pairs = get_file_pairs([path, same_path, os.path.dirname(path)],
+                                    self.output_dir)
+        self.assertEqual(file_pairs, [
+            (path, os.path.join(self.output_dir, 'index.htm'))])
+
+    def test_error_does_not_stop_batch(self):
+        # The end tag without start tag makes cleaning fail.
+        bad = self.write_file('bad.htm',
+                              '<html><body><p>x</font></p></body></html>')
+        good = self.write_file('good.htm', '<html><body><p>y</p></body></html>')
+        results = list(clean_files(get_file_pairs([bad, good],
+                                                  self.output_dir),
+                                   processes=1))
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0][0], bad)
+        self.assertTrue(results[0][1])
+        self.assertEqual(results[1][:3], (good, None, False))
+        self.assertEqual(
+            open(os.path.join(self.output_dir, 'good.htm')).read(),
+            '<html><body><p>y</p></body></html>\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+"""Tests for HtmlCleanupHelper.
+
+Run from the repository root: python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from htmlcleanup import HtmlCleanupHelper
+
+
+class RemoveMultipleTagsTest(unittest.TestCase):
+
+    html = '<font face="A">a</font><font face="B">b</font><font>c</font>'
+
+    def test_same_tag_name_twice(self):
+        self.assertEqual(
+            HtmlCleanupHelper.remove_multiple_tags(
+                self.html, [('font', ['face="A"']), ('font', ['face="B"'])]),
+            'ab<font>c</font>')
+
+    def test_same_tag_name_with_all_tags(self):
+        self.assertEqual(
+            HtmlCleanupHelper.remove_multiple_tags(
+                self.html, [('font', ['face="A"']), ('font', None)]),
+            'abc')
+
+
+class FixMisnestedTagsTest(unittest.TestCase):
+
+    def test_move_start_tag(self):
+        self.assertEqual(
+            HtmlCleanupHelper.fix_misnested_tags('<b> <p>x</b>y</p>',
+                                                 [('b', 'p')]),
+            ' <p><b>x</b>y</p>')
+
+    def test_tag_in_two_pairs(self):
+        # <font> is the block-level tag for <b> and the inline tag for <p>;
+        # it can only be moved once.
+        self.assertEqual(
+            HtmlCleanupHelper.fix_misnested_tags(
+                '<b><font><p>x</b>y</font>z</p>',
+                [('b', 'font'), ('font', 'p')]),
+            '<font><b><p>x</b>y</font>z</p>')
+
+    def test_overlapping_spans(self):
+        self.assertRaises(AssertionError, HtmlCleanupHelper._replace_spans,
+                          'abcdef', [(0, 3, 'x'), (2, 4, 'y')])
+
+
+if __name__ == '__main__':
+    unittest.main()
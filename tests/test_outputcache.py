@@ -0,0 +1,79 @@
+"""Tests for OutputCache.
+
+Run from the repository root: python -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from outputcache import OutputCache
+
+
+class OutputCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def set_items(self, cache):
+        """Store items for 'a', 'b', 'c' of 100 bytes, used in that order.
+
+        Returns a dict with the keys for 'a', 'b', 'c'.
+        """
+        keys = {}
+        for (time, html) in enumerate(['a', 'b', 'c']):
+            keys[html] = cache.get_key(html, 'fingerprint')
+            cache.set(keys[html], html * 100)
+            os.utime(cache._get_path(keys[html]), (1000 + time, 1000 + time))
+        return keys
+
+    def test_hit_and_miss(self):
+        cache = OutputCache(os.path.join(self.directory, 'cache'))
+        key = cache.get_key('<p>x</p>', 'fingerprint')
+        self.assertEqual(cache.get(key), None)
+        cache.set(key, '<p>y</p>')
+        self.assertEqual(cache.get(key), '<p>y</p>')
+        # Also from another object using the same directory.
+        other_cache = OutputCache(os.path.join(self.directory, 'cache'))
+        self.assertEqual(other_cache.get(key), '<p>y</p>')
+        self.assertEqual(cache.get_stats(), {'hits': 1, 'misses': 1,
+                                             'max_size': None})
+
+    def test_key(self):
+        key = OutputCache.get_key('<p>x</p>', 'fingerprint')
+        self.assertEqual(OutputCache.get_key('<p>x</p>', 'fingerprint'), key)
+        self.assertNotEqual(OutputCache.get_key('<p>x</p>', 'fingerprint2'),
+                            key)
+        self.assertNotEqual(OutputCache.get_key('<p>y</p>', 'fingerprint'),
+                            key)
+
+    def test_evict(self):
+        cache = OutputCache(self.directory, 250)
+        keys = self.set_items(cache)
+        self.assertEqual(cache.evict(), 1)
+        self.assertEqual(cache.get(keys['a']), None)
+        self.assertEqual(cache.get(keys['b']), 'b' * 100)
+        self.assertEqual(cache.get(keys['c']), 'c' * 100)
+        # Nothing more to remove.
+        self.assertEqual(cache.evict(), 0)
+
+    def test_get_keeps_item(self):
+        cache = OutputCache(self.directory, 250)
+        keys = self.set_items(cache)
+        # Using the oldest item makes it the most recently used one.
+        self.assertEqual(cache.get(keys['a']), 'a' * 100)
+        self.assertEqual(cache.evict(), 1)
+        self.assertEqual(cache.get(keys['a']), 'a' * 100)
+        self.assertEqual(cache.get(keys['b']), None)
+        self.assertEqual(cache.get(keys['c']), 'c' * 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+"""Tests for SoupCleanupHelper.
+
+Run from the repository root: python -m unittest discover tests
+"""
+
+import os
+import random
+import re
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from BeautifulSoup import BeautifulSoup
+from soupcleanup import SoupCleanupHelper
+
+
+class CheckTablesTest(unittest.TestCase):
+
+    bullet_re = re.compile('bullet')
+
+    def check_tables(self, html):
+        soup = BeautifulSoup(html)
+        SoupCleanupHelper(soup).check_tables(self.bullet_re)
+        return str(soup)
+
+    def test_unwrap_single_cell(self):
+        self.assertEqual(
+            self.check_tables('<table><tr><td>x <b>y</b></td></tr></table>'),
+            '<div style="text-align: left">x <b>y</b></div>')
+
+    def test_bullet_table_to_list(self):
+        self.assertEqual(
+            self.check_tables('<table><tr><td><img src="bullet.gif" /></td>'
+                              '<td>one</td></tr><tr><td>'
+                              '<img src="bullet.gif" /></td><td>two</td></tr>'
+                              '</table>'),
+            '<ul style="text-align: left">\n<li>one</li>\n<li>two</li>\n</ul>')
+
+    def test_no_bullet_table(self):
+        html = '<table><tr><td><img src="x.gif" /></td><td>one</td></tr>' \
+            '<tr><td><img src="x.gif" /></td><td>two</td></tr></table>'
+        self.assertEqual(self.check_tables(html), html)
+
+    def test_bullet_after_removing_nested_table(self):
+        # The empty table next to the bullet is removed before the outer table
+        # is checked for bullets.
+        self.assertEqual(
+            self.check_tables('<table><tr><td><img src="bullet.gif" />'
+                              '<table></table></td><td>one</td></tr></table>'),
+            '<ul style="text-align: left">\n<li>one</li>\n</ul>')
+
+    def test_nested_table_inside_removed_table(self):
+        # The nested table would raise a parse error when checked for bullets;
+        # it is removed together with its parent, which has no cells.
+        self.assertEqual(
+            self.check_tables('<table><tr><table><tr><td>'
+                              '<img src="bullet.gif" /></td><td>a</td></tr>'
+                              '<p>bad</p></table></tr></table><p>x</p>'),
+            '<p>x</p>')
+
+
+def dedupe_whitespace_string_reference(helper, value, at_line_start):
+    """De-duplicate whitespace in a string; return the new string.
+
+    This is the original, slower implementation of
+    SoupCleanupHelper.dedupe_whitespace_string(), which searches the string
+    again from the start for every sequence of whitespace that gets replaced
+    (if dedupe_nbsp is set and at_line_start is True).
+    """
+    result = value
+    # Dedupe spaces at start of our string.
+    # - Replace single &nbsp;s too, unless our constant says not to OR our
+    #   string is at the start of a rendered line.
+    # - Replace _by_ single space, unless the string includes a newline and
+    #   is at the start of a rendered line.
+    rx = helper.rx_multispace_at_start
+    if helper.dedupe_nbsp and not at_line_start:
+        rx = helper.rx_multinbspace_at_start
+    m = rx.search(result)
+    if m:
+        replacement = ' '
+        if at_line_start and m.group(1).find('\n') != -1:
+            replacement = '\n'
+        # This sub() does not need restrictions because we know it replaces
+        # maximum one occurrence.
+        result = rx.sub(replacement, result)
+
+    # Dedupe spaces elsewhere in our string. Since we won't touch the very
+    # start of our string anymore, the replacement is never '\n'.
+    if helper.dedupe_nbsp and at_line_start:
+        # We want to deduplicate &nbsp;s too, but not those wich occur in
+        # whitespace at the very start of our string. (We just explicitly
+        # prevented replacing those, above.) We have a special regex for
+        # this. We should be able to just replace all occurrences with one
+        # command (like in the 'else' below) but \1 does not seem to work
+        # as replacement? So loop and replace one by one.
+        m = helper.rx_multinbspace_not_at_start.search(result)
+        while m:
+            result = helper.rx_multinbspace_not_at_start.sub(
+                m.group(1) + ' ', result, 1)
+            m = helper.rx_multinbspace_not_at_start.search(result)
+    else:
+        # Deduplicate single &nbsp;s too, unless our constant says not to OR
+        # we've already just done it.
+        rx = helper.rx_multinbspace if helper.dedupe_nbsp else \
+            helper.rx_multispace
+        result = rx.sub(' ', result)
+    return result
+
+
+class DedupeWhitespaceStringTest(unittest.TestCase):
+
+    # Pieces which random strings are made of: all kinds of whitespace, and
+    # things which look like (parts of) &nbsp;.
+    pieces = [' ', ' ', '\n', '\t', '\r', '&nbsp;', '&nbsp;', '&nbsp', 'nbsp;',
+              '&', ';', 'a', 'b', '.']
+
+    def test_same_as_reference(self):
+        rng = random.Random(14)
+        helper = SoupCleanupHelper()
+        for dedupe_nbsp in (True, False):
+            helper.dedupe_nbsp = dedupe_nbsp
+            for at_line_start in (True, False):
+                for i in range(5000):
+                    value = ''.join([rng.choice(self.pieces) for j in
+                                     range(rng.randint(0, 20))])
+                    self.assertEqual(
+                        helper.dedupe_whitespace_string(value, at_line_start),
+                        dedupe_whitespace_string_reference(helper, value,
+                                                           at_line_start),
+                        'dedupe_nbsp %s, at_line_start %s: %r'
+                        % (dedupe_nbsp, at_line_start, value))
+
+
+if __name__ == '__main__':
+    unittest.main()